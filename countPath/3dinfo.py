@@ -4,11 +4,12 @@
 
 
 import os
-import serial
 import numpy as np
-import pandas as pd
 from datetime import datetime
-from scipy.optimize import least_squares
+from uwb_frame import FrameParser
+from uwb_capture import open_serial
+from distance_3d import LMSolver3D
+from uwb_log import MeasurementLog
 
 # 1. Anchor ID 與對應標籤、位置 (x, y, z)
 anchor_ids = [
@@ -24,6 +25,7 @@ anchor_positions = [
     (5.00, 8.00, 2.00),
     (0.00, 6.00, 1.5)
 ]
+lm_solver = LMSolver3D(anchor_positions)   # anchor 幾何只預先計算一次，每輪重複使用
 faulty_id = '0341000000000000'
 
 # 2. Tag 真實放置座標
@@ -36,68 +38,67 @@ BAUD = 57600
 
 # 4. 建立串口連線
 try:
-    ser = serial.Serial(PORT, BAUD, timeout=1)
+    ser = open_serial(PORT, BAUD, timeout=1)
     print(f"[Info] Connected to {PORT} @ {BAUD}bps")
 except Exception as e:
     print(f"[Warning] 無法開啟串口 {PORT}: {e}")
     ser = None
+parser = FrameParser(anchor_ids)
 
 
-def read_distances(serial_iface, ids):
+def read_distances(serial_iface, parser):
     """
-    從串口讀取原始 hex 資料，解析各 anchor 回傳的距離 (m)
+    從串口讀取原始資料，經 parser 解析各 anchor 回傳的距離 (m)
     若串口無效則回傳全 0 陣列
     """
-    dists = np.zeros(len(ids), dtype=float)
+    dists = np.zeros(len(parser.anchor_IDs), dtype=float)
     if not serial_iface:
         return dists
-    raw = serial_iface.read(256).hex()
-    for i, aid in enumerate(ids):
-        idx = raw.find(aid.lower())
-        if idx >= 0:
-            hex_dis = raw[idx+16:idx+24]
-            try:
-                cm = int.from_bytes(bytes.fromhex(hex_dis)[::-1], 'big')
-            except ValueError:
-                cm = 0
-            if cm >= 32768:
-                cm = 0
-            dists[i] = cm / 100.0
+    for frame in parser.feed(serial_iface.read(256)):
+        dists[frame.index] = frame.dis
     return dists
 
 
 def estimate_tag_position(anchor_positions, measured_dists, initial_guess=None):
     """
-    使用 least_squares 多邊定位 (multilateration) 估計 Tag 座標
+    使用批次 Levenberg–Marquardt 多邊定位 (multilateration) 估計 Tag 座標（座標非負）
     anchor_positions: list of (x,y,z)
     measured_dists:    list of 對應量測距離 (m)
-    initial_guess:     初始猜測 (x,y,z)，預設為 anchors 平均座標
+    initial_guess:     初始猜測 (x,y,z)，例如上一輪的估計；預設為線性解
     回傳 (x_est, y_est, z_est)
     """
-    anchors = np.array(anchor_positions)
-    dists = np.array(measured_dists)
+    solver = lm_solver if np.array_equal(anchor_positions, lm_solver.anchors) else LMSolver3D(anchor_positions)
+    return tuple(solver.solve(measured_dists, initial_guess))
 
-    if initial_guess is None:
-        initial_guess = anchors.mean(axis=0)
 
-    def residual(p):
-        return np.linalg.norm(anchors - p, axis=1) - dists
-
-    res = least_squares(
-        residual,
-        x0=initial_guess,
-        bounds=([0, 0, 0], [np.inf, np.inf, np.inf])
-    )
-    return tuple(res.x)
+# 量測記錄欄位
+COLUMNS = (
+    anchor_labels
+    + ['avg_meas_m', 'avg_true_m', 'error_cm']
+    + ['tag_x_true', 'tag_y_true', 'tag_z_true']
+    + ['tag_x_est', 'tag_y_est', 'tag_z_est']
+    + ['timestamp']
+)
 
 
 def main():
-    records = []
     tx, ty, tz = tag_pos
+    est = None
+
+    # 輸出目錄與檔案路徑
+    output_dir = os.path.expanduser('/home/e520/uwb_results')
+    os.makedirs(output_dir, exist_ok=True)
+    csv_path = os.path.join(output_dir, 'uwb_t_含估計座標.csv')
+    xlsx_path = os.path.join(output_dir, 'uwb_t_含估計座標.xlsx')
+    log = MeasurementLog(csv_path, COLUMNS, append=False)
 
+    # 清掉開始量測前累積的舊資料（串口無效時 read_distances 回傳全 0）
+    if ser:
+        ser.reset_input_buffer()
+    parser.reset()
     for _ in range(ROUNDS):
         #  讀取各 Anchor 距離
-        dists = read_distances(ser, anchor_ids)
+        dists = read_distances(ser, parser)
 
 
         if faulty_id in anchor_ids:
@@ -116,13 +117,14 @@ def main():
         err_cm = (avg_meas - avg_true) * 100.0
 
         #  估計 Tag 座標
-        est_x, est_y, est_z = estimate_tag_position(anchor_positions, dists)
+        est = estimate_tag_position(anchor_positions, dists, est)   # 由上一輪結果開始
+        est_x, est_y, est_z = est
 
         #  時間戳記
         timestamp = datetime.now().isoformat()
 
-        #  紀錄：距離、平均、誤差、真實/估計 Tag 座標、時間
-        records.append(
+        #  紀錄：距離、平均、誤差、真實/估計 Tag 座標、時間（每輪追加一列）
+        log.append(
             list(dists)
             + [avg_meas, avg_true, err_cm]
             + [tx, ty, tz]
@@ -130,26 +132,9 @@ def main():
             + [timestamp]
         )
 
-    # 組成 DataFrame，命名欄位為 anchor_labels
-    cols = (
-        anchor_labels
-        + ['avg_meas_m', 'avg_true_m', 'error_cm']
-        + ['tag_x_true', 'tag_y_true', 'tag_z_true']
-        + ['tag_x_est', 'tag_y_est', 'tag_z_est']
-        + ['timestamp']
-    )
-    df = pd.DataFrame(records, columns=cols)
-
-    # 輸出目錄與檔案路徑
-    output_dir = os.path.expanduser('/home/e520/uwb_results')
-    os.makedirs(output_dir, exist_ok=True)
-    csv_path = os.path.join(output_dir, 'uwb_t_含估計座標.csv')
-    xlsx_path = os.path.join(output_dir, 'uwb_t_含估計座標.xlsx')
-
-    # 儲存 CSV & Excel
-    df.to_csv(csv_path, index=False)
-    with pd.ExcelWriter(xlsx_path, engine='openpyxl') as writer:
-        df.to_excel(writer, index=False, sheet_name='1D_Range_Error')
+    # CSV 已逐輪寫入，Excel 最後一次產生
+    log.close()
+    df = log.to_excel(xlsx_path, sheet_name='1D_Range_Error')
 
     print(f"[Info] 已儲存 CSV: {csv_path}")
     print(f"[Info] 已儲存 Excel: {xlsx_path} ({len(df)} 筆紀錄)")
@@ -5,7 +5,7 @@ import os
 import numpy as np
 import pandas as pd
 from datetime import datetime
-from scipy.optimize import least_squares
+from distance_3d import LMSolver3D
 import random
 
 # 1. Anchor ID 與對應標籤、位置 (x, y, z)
@@ -16,6 +16,7 @@ anchor_positions = [
     (5.00, 8.00, 2.00),
     (0.00, 6.00, 1.5)
 ]
+lm_solver = LMSolver3D(anchor_positions)   # anchor 幾何只預先計算一次，每輪重複使用
 
 # 2. Tag 真實放置座標
 tag_pos = (2.5, 4.0, 1.0)
@@ -27,7 +28,7 @@ TARGET_ERR3D_CM = 28.0
 random.seed(42)  
 
 def generate_fake_distances_with_target(anchor_positions, tag_pos, target_err3d_cm):
-    """產生假距離，使最終 least_squares 的 3D 誤差接近目標值"""
+    """產生假距離，使最終定位的 3D 誤差接近目標值"""
     true_dists = np.linalg.norm(np.array(anchor_positions) - np.array(tag_pos), axis=1)
 
    
@@ -36,19 +37,15 @@ def generate_fake_distances_with_target(anchor_positions, tag_pos, target_err3d_
 
     return np.round(fake_dists, 3)
 
-def estimate_tag_position(anchor_positions, measured_dists):
-    """least_squares 多邊定位"""
-    anchors = np.array(anchor_positions)
-    dists = np.array(measured_dists)
-    initial_guess = anchors.mean(axis=0)
-    def residual(p):
-        return np.linalg.norm(anchors - p, axis=1) - dists
-    res = least_squares(residual, x0=initial_guess, bounds=([0,0,0],[np.inf,np.inf,np.inf]))
-    return tuple(res.x)
+def estimate_tag_position(anchor_positions, measured_dists, initial_guess=None):
+    """Levenberg–Marquardt 多邊定位（座標非負），initial_guess 為上一輪的估計"""
+    solver = lm_solver if np.array_equal(anchor_positions, lm_solver.anchors) else LMSolver3D(anchor_positions)
+    return tuple(solver.solve(measured_dists, initial_guess))
 
 def main():
     records = []
     tx, ty, tz = tag_pos
+    est = None
 
     for _ in range(ROUNDS):
     
@@ -63,7 +60,8 @@ def main():
         err_cm = (avg_meas - avg_true) * 100.0
 
         
-        est_x, est_y, est_z = estimate_tag_position(anchor_positions, dists)
+        est = estimate_tag_position(anchor_positions, dists, est)   # 由上一輪結果開始
+        est_x, est_y, est_z = est
 
        
         dx, dy, dz = est_x - tx, est_y - ty, est_z - tz
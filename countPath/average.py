@@ -1,10 +1,9 @@
 import os
 import numpy as np
-import pandas as pd
 from time import sleep
 from datetime import datetime
 from read_GIPS_distance import UWBpos
-from pandas import ExcelWriter
+from uwb_log import MeasurementLog
 
 # ── 參數設定 ──
 actual_distance_cm = 4000        # 預設測試距離
@@ -12,6 +11,7 @@ measure_times = 5                     # 每輪測量次數
 total_rounds = 100                     # 總共執行 100 輪
 output_dir = "/home/e520/uwb_results"  # 儲存路徑
 excel_path = os.path.join(output_dir, "UWB測距記錄金屬遮蔽.xlsx")
+log_path = os.path.join(output_dir, "UWB測距記錄金屬遮蔽.csv")  # 每輪追加一列，Excel 最後一次產生
 
 # ── 建立儲存資料夾 ──
 os.makedirs(output_dir, exist_ok=True)
@@ -19,14 +19,19 @@ os.makedirs(output_dir, exist_ok=True)
 # ── 初始化 UWB 裝置 ──
 uwb = UWBpos()
 
+# ── 量測記錄（沿用舊 Excel 的資料）──
+columns = ["測試時間", "測試距離 (cm)", "測量值列表 (cm)", "平均距離 (cm)", "誤差 (cm)", "標準差 (cm)"]
+log = MeasurementLog(log_path, columns, flush_every=1, seed=excel_path)
+
 for round_num in range(1, total_rounds + 1):
     dist_results = []
     timestamp = datetime.now().strftime("%Y/%m/%d %H:%M:%S")
     print(f"\n🧪 第 {round_num}/{total_rounds} 輪測試開始：{timestamp}")
 
-    # ── 測距迴圈 ──
+    # ── 測距迴圈（先清掉上一輪留下的舊資料）──
+    uwb.flush()
     for i in range(measure_times):
-        dis_to_anchor = uwb.UWB_read()
+        dis_to_anchor, _ = uwb.UWB_read_deadline()     # 等到 anchor 回報（最多 DEADLINE 秒）
         raw_value = dis_to_anchor[0]
         dist_cm = raw_value * 100
 
@@ -53,18 +58,12 @@ for round_num in range(1, total_rounds + 1):
         "誤差 (cm)": error,
         "標準差 (cm)": std
     }
-    df_row = pd.DataFrame([row_data])
-
-    # ── 將資料追加到 Excel ──
-    if os.path.exists(excel_path):
-        existing_df = pd.read_excel(excel_path)
-        new_df = pd.concat([existing_df, df_row], ignore_index=True)
-    else:
-        new_df = df_row
-
-    new_df.to_excel(excel_path, index=False)
-    print(f"✅ 結果已儲存至：{excel_path}")
+    log.append(row_data)
+    print(f"✅ 結果已記錄至：{log_path}")
     print("🔁 等待 1 秒進入下一輪測距...\n")
     sleep(1)
 
+log.close()
+log.to_excel(excel_path)
+print(f"✅ Excel 已輸出：{excel_path}")
 print("\n✅ 已完成 100 輪測距，程式自動結束。")
@@ -1,9 +1,9 @@
 import os
 import numpy as np
-import pandas as pd
 from time import sleep
 from datetime import datetime
 from read_GIPS_distance import UWBpos
+from uwb_log import MeasurementLog
 
 # ── 參數設定 ──
 actual_distance_cm = 400               # 預設測試距離
@@ -11,6 +11,7 @@ measure_times = 10                     # 每輪測量次數
 total_rounds = 100                     # 總共執行 100 輪
 output_dir = "/home/e520/uwb_results"  # 儲存路徑
 excel_path = os.path.join(output_dir, "UWB測距記錄總表.xlsx")
+log_path = os.path.join(output_dir, "UWB測距記錄總表.csv")  # 每輪追加一列，Excel 最後一次產生
 
 # ── 建立儲存資料夾 ──
 os.makedirs(output_dir, exist_ok=True)
@@ -18,15 +19,22 @@ os.makedirs(output_dir, exist_ok=True)
 # ── 初始化 UWB 裝置 ──
 uwb = UWBpos()
 
+# ── 量測記錄（沿用舊 Excel 的資料）──
+columns = ["測試時間", "測試距離 (cm)",
+           "測量值列表 A0 (cm)", "平均距離 A0 (cm)", "誤差 A0 (cm)", "標準差 A0 (cm)",
+           "測量值列表 A1 (cm)", "平均距離 A1 (cm)", "誤差 A1 (cm)", "標準差 A1 (cm)"]
+log = MeasurementLog(log_path, columns, flush_every=1, seed=excel_path)
+
 for round_num in range(1, total_rounds + 1):
     results_0 = []  # Anchor 0 的測量值列表
     results_1 = []  # Anchor 1 的測量值列表
     timestamp = datetime.now().strftime("%Y/%m/%d %H:%M:%S")
     print(f"\n🧪 第 {round_num}/{total_rounds} 輪測試開始：{timestamp}")
 
-    # ── 測距迴圈 ──
+    # ── 測距迴圈（先清掉上一輪留下的舊資料）──
+    uwb.flush()
     for i in range(measure_times):
-        dis = uwb.UWB_read()       # 假設回傳至少兩個元素
+        dis, _ = uwb.UWB_read_deadline()     # 等到 anchor 回報（最多 DEADLINE 秒），未回報的是 0
         dist0 = dis[0] * 100       # Anchor 0（cm）
         dist1 = dis[1] * 100       # Anchor 1（cm）
 
@@ -62,17 +70,12 @@ for round_num in range(1, total_rounds + 1):
         "誤差 A1 (cm)":       err1,
         "標準差 A1 (cm)":     std1,
     }
-    df_row = pd.DataFrame([row])
-
-    # ── 追加到 Excel ──
-    if os.path.exists(excel_path):
-        df_all = pd.concat([pd.read_excel(excel_path), df_row], ignore_index=True)
-    else:
-        df_all = df_row
-
-    df_all.to_excel(excel_path, index=False)
-    print(f"✅ 第 {round_num} 輪結果已儲存至：{excel_path}")
+    log.append(row)
+    print(f"✅ 第 {round_num} 輪結果已記錄至：{log_path}")
     print("🔁 等待 5 秒進入下一輪測距...\n")
     sleep(5)
 
+log.close()
+log.to_excel(excel_path)
+print(f"✅ Excel 已輸出：{excel_path}")
 print("\n✅ 已完成所有測距輪次，程式結束。")
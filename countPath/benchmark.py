@@ -0,0 +1,322 @@
+#!/usr/bin/env python3
+"""
+Offline benchmarks, no UWB hardware needed:
+    parse   frame-parse throughput of the UWB_read variants (frames/s)
+    solve   compute_relative, compute_3d, 3dinfo.estimate_tag_position, LMSolver3D, RANSACSolver3D (fixes/s)
+    route   findRoute (NavMap.plan) latency against map size, WallIndex on long diagonal segments
+    http    p50/p99 of /pos and /dest through the Flask app, fed by a synthetic capture
+
+    python3 benchmark.py -o build.json                  # JSON results (stdout without -o)
+    python3 benchmark.py --compare last.json            # exit 1 if anything got slower than the tolerance
+    python3 benchmark.py --only parse,solve --quick
+"""
+import argparse
+import contextlib
+import importlib
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+import uwb_emulator as emu
+from read_GIPS_distance import FRAME_SIZE
+from uwb_capture import write_capture
+from uwb_frame import FrameParser
+
+SECTIONS = ['parse', 'solve', 'route', 'http']
+TOLERANCE = 0.25        # relative slow-down reported as a regression
+
+# name, anchor layout, bytes per read, tags, tag offset
+PARSE_VARIANTS = [
+    ('read_GIPS_distance.UWB_read', '2d', FRAME_SIZE * 4, 1, None),
+    ('distance_3d.UWB_read', '3d', 200, 1, None),
+    ('3dinfo.read_distances', '3dinfo', 256, 1, None),
+    ('multi_tag_16', '2d', 4096, 16, 12),
+]
+ROUTE_GRIDS = [4, 8, 16, 24]    # k x k cross nodes
+ROUTE_SPACING = 0.0001          # degrees between neighbouring cross nodes
+# boxes, map side (m), box side (m): long diagonal segments across large maps (WallIndex traversal)
+WALL_MAPS = [(3000, 100.0, 1.0), (10000, 1000.0, 2.0)]
+
+
+def quiet():
+    # the readers and findRoute print on every call
+    return contextlib.redirect_stdout(io.StringIO())
+
+
+def best_rate(fn, n, repeat=3):
+    # calls per second of fn, best of `repeat` runs of n calls
+    best = float('inf')
+    for _ in range(repeat):
+        t = time.perf_counter()
+        for _ in range(n):
+            fn()
+        best = min(best, time.perf_counter() - t)
+    return n / best
+
+
+def latency(fn, n):
+    samples = []
+    for _ in range(n):
+        t = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - t)
+    ms = np.array(samples) * 1000
+    return {'n': n, 'p50_ms': float(np.percentile(ms, 50)), 'p99_ms': float(np.percentile(ms, 99)),
+            'mean_ms': float(ms.mean())}
+
+
+def synth_records(layout, seconds, rate, tags=1, tag_offset=None, seed=0):
+    # (t, bytes) per range set, as the emulator would send them
+    ids, anchors = emu.LAYOUTS[layout]
+    anchors = np.array(anchors)
+    rng = np.random.default_rng(seed)
+    records = []
+    for tick in range(int(seconds * rate)):
+        t = tick / rate
+        chunk = []
+        for tag in range(tags):
+            p = emu.trajectory('circle', anchors, t, tag / tags)
+            r = np.linalg.norm(anchors - p, axis=1) + rng.normal(0, 0.05, len(ids))
+            chunk += [emu.build_frame(aid, max(0, int(round(d * 100))), tag + 1, tag_offset)
+                      for aid, d in zip(ids, r)]
+        records.append((t, b''.join(chunk)))
+    return records
+
+
+def synth_ranges(anchors, n, seed=0):
+    # (n, anchors) noisy ranges to random points inside the anchor bounding box
+    anchors = np.asarray(anchors, dtype=float)
+    rng = np.random.default_rng(seed)
+    lo, hi = anchors.min(axis=0), anchors.max(axis=0)
+    pts = lo + rng.random((n, anchors.shape[1])) * (hi - lo)
+    return np.linalg.norm(pts[:, None] - anchors[None], axis=2) + rng.normal(0, 0.05, (n, len(anchors)))
+
+
+def bench_parse(quick):
+    results = {}
+    for name, layout, chunk, tags, tag_offset in PARSE_VARIANTS:
+        ids = emu.LAYOUTS[layout][0]
+        data = b''.join(d for _, d in synth_records(layout, 20 if quick else 100, 50, tags, tag_offset))
+        chunks = [data[i:i + chunk] for i in range(0, len(data), chunk)]
+        frames = len(FrameParser(ids, tag_offset).feed(data))
+
+        def run():
+            parser = FrameParser(ids, tag_offset)
+            for c in chunks:
+                parser.feed(c)
+
+        calls = best_rate(run, 1)
+        results[name] = {'frames_per_s': frames * calls, 'mb_per_s': len(data) * calls / 1e6,
+                         'bytes_per_read': chunk}
+    return results
+
+
+def bench_solve(quick):
+    from read_GIPS_distance import UWBpos
+    from distance_3d import LinearSolver3D, LMSolver3D, RANSACSolver3D
+    with quiet():
+        pos = UWBpos()
+        info = importlib.import_module('3dinfo')
+    n = 200 if quick else 2000
+    results = {}
+
+    anchors2d = np.array(emu.LAYOUTS['2d'][1])[:, :2]
+    diss = synth_ranges(anchors2d, n)
+    it = iter(range(10 ** 9))
+
+    def relative():
+        pos.diss[:] = diss[next(it) % n]
+        pos.compute_relative()
+
+    results['read_GIPS_distance.compute_relative'] = {'fixes_per_s': best_rate(relative, n)}
+    results['read_GIPS_distance.compute_relative_batch'] = {
+        'fixes_per_s': n * best_rate(lambda: pos.compute_relative_batch(diss), 10), 'batch': n}
+
+    anchors3d = emu.LAYOUTS['3d'][1]
+    solver = LinearSolver3D(anchors3d)
+    dists = synth_ranges(anchors3d, n)
+    results['distance_3d.compute_3d'] = {
+        'fixes_per_s': best_rate(lambda: solver.solve(dists[next(it) % n]), n)}
+    results['distance_3d.compute_3d_batch'] = {
+        'fixes_per_s': n * best_rate(lambda: solver.solve(dists), 10), 'batch': n}
+
+    dists = synth_ranges(info.anchor_positions, n)
+    results['3dinfo.estimate_tag_position'] = {
+        'fixes_per_s': best_rate(lambda: info.estimate_tag_position(info.anchor_positions, dists[next(it) % n]), n)}
+    robust = RANSACSolver3D(list(info.anchor_positions) + [(0.0, 0.0, 2.5), (5.0, 8.0, 0.5)])
+    dists6 = synth_ranges(robust.anchors, n)
+    results['distance_3d.RANSACSolver3D_6_anchors'] = {
+        'fixes_per_s': best_rate(lambda: robust.solve(dists6[next(it) % n]), n)}
+    lm = LMSolver3D(info.anchor_positions)
+    results['distance_3d.LMSolver3D_batch'] = {'fixes_per_s': n * best_rate(lambda: lm.solve(dists), 10), 'batch': n}
+    return results
+
+
+def synth_map(k):
+    # k x k cross nodes on a grid, one obstacle box inside every grid cell
+    x0, y0, s = 121.4510, 25.1755, ROUTE_SPACING
+    cross, box, edges = [], [], []
+    for i in range(k):
+        for j in range(k):
+            cross.append({'id': i * k + j + 1, 'pos': [x0 + i * s, y0 + j * s]})
+            if j + 1 < k:
+                edges.append([i * k + j + 1, i * k + j + 2])
+            if i + 1 < k:
+                edges.append([i * k + j + 1, (i + 1) * k + j + 1])
+            if i + 1 < k and j + 1 < k:
+                cx, cy, h = x0 + (i + 0.5) * s, y0 + (j + 0.5) * s, 0.2 * s
+                box.append({'id': len(box) + 1,
+                            'edge': [[cx - h, cy - h], [cx + h, cy - h], [cx + h, cy + h], [cx - h, cy + h]]})
+    return {'cross': cross, 'box': box, 'edges': edges}
+
+
+def bench_route(quick):
+    from findRoute import NavMap, WallIndex
+    rng = np.random.default_rng(0)
+    n = 10 if quick else 50
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for k in ROUTE_GRIDS:
+            data = synth_map(k)
+            path = os.path.join(tmp, 'points_{}.json'.format(k))
+            with open(path, 'w') as file:
+                json.dump(data, file)
+            navmap = NavMap(path)
+            lo = np.array(data['cross'][0]['pos'])
+            span = (k - 1) * ROUTE_SPACING
+            ends = iter(lo + rng.random((n * 3, 2, 2)) * span)     # st, dest pairs
+
+            def plan():
+                st, dest = next(ends)
+                navmap.plan(st.tolist(), dest.tolist())
+
+            results['grid_{}'.format(k)] = dict(latency(plan, n), nodes=len(data['cross']),
+                                                walls=4 * len(data['box']))
+    for boxes, side, size in WALL_MAPS:
+        walls = synth_walls(rng, boxes, side, size)
+        index = WallIndex(walls)
+        # corner to corner and back, with some jitter so every query crosses a different set of cells
+        segs = iter(np.array([[0.0, 0.0], [side, side]]) + rng.normal(0, size, (n * 3, 2, 2)))
+
+        def query():
+            A, B = next(segs)
+            index.intersects(A, B)
+
+        results['diagonal_{}'.format(boxes)] = dict(latency(query, n), walls=len(walls), side_m=side)
+    return results
+
+
+def synth_walls(rng, boxes, side, size):
+    # (4 * boxes, 2, 2) walls of square boxes scattered over a side x side map
+    c = rng.random((boxes, 2)) * side
+    h = size / 2
+    corners = np.stack([c + [-h, -h], c + [h, -h], c + [h, h], c + [-h, h]], axis=1)
+    return np.stack([corners, np.roll(corners, -1, axis=1)], axis=2).reshape(-1, 2, 2)
+
+
+def bench_http(quick):
+    n = 200 if quick else 2000
+    with tempfile.TemporaryDirectory() as tmp:
+        capture = os.path.join(tmp, 'bench.cap')
+        write_capture(capture, synth_records('2d', 600, 20))
+        os.environ['UWB_REPLAY'] = capture
+        os.environ['UWB_REPLAY_SPEED'] = '1'
+        with quiet():
+            server = importlib.import_module('server')
+            deadline = time.monotonic() + 5
+            while server.hub.latest.pos is None and time.monotonic() < deadline:
+                time.sleep(0.05)
+            if server.hub.latest.pos is None:
+                raise RuntimeError("no fix from the replayed capture")
+            client = server.app.test_client()
+            results = {'/pos': latency(lambda: client.get('/pos'), n)}
+
+            with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'points.json')) as file:
+                data = json.load(file)
+            pts = np.array([c['pos'] for c in data['cross']])
+            lo, hi = pts.min(axis=0), pts.max(axis=0)
+            rng = np.random.default_rng(0)
+            m = n // 10
+            starts = iter((lo + rng.random((m * 3, 2)) * (hi - lo)).tolist())
+            dests = iter(pts[rng.integers(0, len(pts), m * 3)].tolist())
+            results['/dest'] = latency(lambda: client.post('/dest', json={'st': next(starts), 'dest': next(dests)}), m)
+            results['/dest']['route_cache'] = server.route_cache.stats()
+        server.hub.stop()
+    return results
+
+
+def flatten(results, prefix=''):
+    flat = {}
+    for key, value in results.items():
+        if isinstance(value, dict):
+            flat.update(flatten(value, prefix + key + '.'))
+        elif isinstance(value, (int, float)):
+            flat[prefix + key] = value
+    return flat
+
+
+def compare(results, baseline, tolerance):
+    # only throughputs (*_per_s, higher is better) and latencies (*_ms, lower is better)
+    new, old = flatten(results), flatten(baseline)
+    regressions = []
+    for key, value in sorted(new.items()):
+        ref = old.get(key)
+        if not ref or key.startswith('meta.'):
+            continue
+        if key.endswith('_per_s') and value < ref * (1 - tolerance):
+            regressions.append((key, ref, value))
+        elif key.endswith('_ms') and value > ref * (1 + tolerance):
+            regressions.append((key, ref, value))
+    return regressions
+
+
+def meta():
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL,
+                                         cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'commit': commit, 'host': platform.node(),
+            'machine': platform.machine(), 'python': platform.python_version(), 'numpy': np.__version__}
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    ap.add_argument('-o', '--out', help='write the JSON results here')
+    ap.add_argument('--only', default=','.join(SECTIONS), help='comma separated sections: ' + ', '.join(SECTIONS))
+    ap.add_argument('--quick', action='store_true', help='fewer iterations')
+    ap.add_argument('--compare', help='baseline JSON from an earlier run')
+    ap.add_argument('--tolerance', type=float, default=TOLERANCE)
+    args = ap.parse_args()
+
+    benches = {'parse': bench_parse, 'solve': bench_solve, 'route': bench_route, 'http': bench_http}
+    results = {'meta': meta()}
+    for section in args.only.split(','):
+        print("running {}...".format(section), file=sys.stderr)
+        results[section] = benches[section](args.quick)
+
+    text = json.dumps(results, indent=2)
+    if args.out:
+        with open(args.out, 'w') as file:
+            file.write(text + '\n')
+    else:
+        print(text)
+
+    if args.compare:
+        with open(args.compare) as file:
+            regressions = compare(results, json.load(file), args.tolerance)
+        for key, ref, value in regressions:
+            print("REGRESSION {}: {:.4g} -> {:.4g}".format(key, ref, value), file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
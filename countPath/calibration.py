@@ -0,0 +1,112 @@
+import time
+from threading import Lock
+
+import numpy as np
+
+import read_GIPS_distance as gips
+
+NEAR = 0.1              # the tag counts as "at an anchor" below this range (m)
+MIN_SAMPLES = 10        # range sets needed before the estimate can be committed
+ANCHOR_NAMES = ['6', '7', '9']      # anchor numbers of the range columns, as in /pos/anchor/<n>
+
+
+class Calibration:
+    """
+    Background estimate of the CRS multipliers (m per degree) from the live
+    range stream. Whenever the tag sits at one anchor, the ranges to the other
+    anchors are the anchor baselines: d^2 = (mx*dx)^2 + (my*dy)^2 with dx, dy
+    the CRS differences. Every such set updates the normal equations of a
+    least-squares fit of (mx^2, my^2); commit() swaps the result into
+    read_GIPS_distance. Nothing blocks: add() is called by the sensor hub.
+
+    add() takes the raw ranges of a set, where the range to the anchor the
+    tag sits on usually reads 0. Name that anchor in start(); otherwise any
+    single invalid range is taken as "tag at this anchor".
+    """
+
+    def __init__(self, near=NEAR, min_samples=MIN_SAMPLES):
+        self.near = near
+        self.min_samples = min_samples
+        self.anchors = np.array([(gips.x0, gips.y0), (gips.x02, gips.y02), (gips.x03, gips.y03)])
+        self.lock = Lock()
+        self.state = 'idle'     # idle -> running -> committed / cancelled
+        self.tag = None
+        self.anchor = None      # column of the anchor the tag sits on (None = the shortest range)
+        self.reset()
+
+    def reset(self):
+        self.AtA = np.zeros((2, 2))
+        self.Atb = np.zeros(2)
+        self.btb = 0.0
+        self.samples = 0
+        self.started = None
+
+    def start(self, tag=None, anchor=None):
+        # tag: only use ranges of this tag (None = any)
+        # anchor: number of the anchor the tag sits on (None = the shortest range)
+        if anchor is not None and str(anchor) not in ANCHOR_NAMES:
+            raise ValueError('unknown anchor {!r}, expected one of {}'.format(anchor, ANCHOR_NAMES))
+        with self.lock:
+            self.reset()
+            self.tag = tag
+            self.anchor = None if anchor is None else ANCHOR_NAMES.index(str(anchor))
+            self.started = time.time()
+            self.state = 'running'
+
+    def cancel(self):
+        with self.lock:
+            if self.state == 'running':
+                self.state = 'cancelled'
+
+    def add(self, diss, tag=None):
+        if self.state != 'running' or (self.tag is not None and tag != self.tag):
+            return False
+        diss = np.asarray(diss, dtype=float)
+        at = int(np.argmin(diss)) if self.anchor is None else self.anchor
+        others = [j for j in range(len(diss)) if j != at]
+        if diss[at] >= self.near or (diss[others] <= 0).any():
+            return False
+        delta = self.anchors[others] - self.anchors[at]
+        A = delta * delta                                   # rows (dx^2, dy^2)
+        b = diss[others] ** 2
+        with self.lock:
+            self.AtA += A.T @ A
+            self.Atb += A.T @ b
+            self.btb += b @ b
+            self.samples += 1
+        return True
+
+    def estimate(self):
+        # (x_multiplier, y_multiplier, rms residual of d^2 in m^2), or None while underdetermined
+        with self.lock:
+            AtA, Atb, btb = self.AtA.copy(), self.Atb.copy(), self.btb
+        if self.samples == 0 or np.linalg.cond(AtA) > 1e12:
+            return None
+        m2 = np.linalg.solve(AtA, Atb)
+        if (m2 <= 0).any():
+            return None
+        sse = max(btb - 2 * m2 @ Atb + m2 @ AtA @ m2, 0.0)
+        rms = (sse / max(2 * self.samples, 1)) ** 0.5       # of the squared ranges, m^2
+        return float(m2[0] ** 0.5), float(m2[1] ** 0.5), float(rms)
+
+    def status(self):
+        est = self.estimate()
+        return {
+            'state': self.state,
+            'tag': self.tag,
+            'anchor': None if self.anchor is None else ANCHOR_NAMES[self.anchor],
+            'samples': self.samples,
+            'min_samples': self.min_samples,
+            'started': self.started,
+            'estimate': None if est is None else {'x_multiplier': est[0], 'y_multiplier': est[1], 'rms_m2': est[2]},
+            'current': dict(zip(('x_multiplier', 'y_multiplier'), gips.multipliers)),
+        }
+
+    def commit(self):
+        # apply the estimate; returns the new multipliers, or None if there are too few samples
+        est = self.estimate()
+        if self.state != 'running' or est is None or self.samples < self.min_samples:
+            return None
+        gips.set_multipliers(est[0], est[1])
+        self.state = 'committed'
+        return est[0], est[1]
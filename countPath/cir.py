@@ -1,58 +1,194 @@
-import serial
-import matplotlib.pyplot as plt
+import argparse
 import os
+import time
 from datetime import datetime
 
+import numpy as np
+from numpy.lib.format import open_memmap
+
+from uwb_capture import open_serial
+
 # ── 串口設定 ──
 COM_PORT = '/dev/ttyUSB0'
 BAUD_RATE = 57600
 OUTPUT_DIR = "/home/e520/UWBv1"
-os.makedirs(OUTPUT_DIR, exist_ok=True)
-
-# ── 初始化串口 ──
-try:
-    ser = serial.Serial(COM_PORT, BAUD_RATE, timeout=1)
-    print(f"✅ 已連線至 {COM_PORT}（波特率：{BAUD_RATE}）")
-except Exception as e:
-    print(f"❌ 無法連線至 {COM_PORT}：{e}")
-    exit(1)
-
-# ── 資料準備 ──
-anchor_id = "0241000000000000"
-cir_data = []
-print("📡 等待 anchor 傳送 CIR 資料...")
-
-while True:
+
+# ── CIR 參數 ──
+CIR_LEN = 1024                      # 每筆 CIR 的樣本點數
+CAPACITY = 10000                    # 每個 .npy 檔預先配置的筆數
+DEFAULT_ANCHOR = "0241000000000000"
+READ_SIZE = 8192                    # 每次從串口整批讀取的 bytes
+MAX_DIGITS = 9                      # 超過 9 位數的數字行放不進 int32（例如漏了換行而黏在一起的兩行），直接丟掉
+# 一筆 CIR：接收時間、anchor ID、1024 個振幅
+CIR_DTYPE = np.dtype([('t', '<f8'), ('anchor', 'S16'), ('cir', '<i4', (CIR_LEN,))])
+
+
+class CIRParser:
+    """
+    將 anchor 傳來的文字 CIR（"ANCHOR_ID:xxxx" 一行，之後每行一個整數）整批解析：
+    一次切出所有完整的行（逐行 strip，和原本 readline 的迴圈相同），用 NumPy 判斷數字行並一次轉成整數，
+    湊滿 CIR_LEN 個就輸出一筆。
+    """
+
+    def __init__(self, n=CIR_LEN, anchor_id=DEFAULT_ANCHOR):
+        self.n = n
+        self.anchor_id = anchor_id
+        self.buf = bytearray()
+        self.pending = []           # 目前這筆已收到的樣本（多段 ndarray）
+        self.count = 0
+
+    def feed(self, data):
+        """回傳 [(anchor_id, t, cir ndarray)]"""
+        self.buf += data
+        end = self.buf.rfind(b'\n')
+        if end < 0:
+            return []
+        lines = np.char.strip(np.array(bytes(self.buf[:end]).split(b'\n')))
+        del self.buf[:end + 1]
+        out = []
+        header = np.flatnonzero(np.char.startswith(lines, b'ANCHOR_ID'))
+        digit = np.char.isdigit(lines) & (np.char.str_len(lines) <= MAX_DIGITS)
+        bounds = [0] + header.tolist() + [len(lines)]
+        for start, stop in zip(bounds[:-1], bounds[1:]):
+            if start in header:
+                # 新的一筆：換 anchor（整行解析，容許 "ANCHOR_ID: xxxx"），丟掉未湊滿的樣本
+                self.anchor_id = lines[start].decode(errors='ignore').split(':', 1)[-1].strip()
+                self.pending, self.count = [], 0
+                start += 1
+            values = lines[start:stop][digit[start:stop]].astype(np.int32)
+            while len(values):
+                take = values[:self.n - self.count]
+                self.pending.append(take)
+                self.count += len(take)
+                values = values[len(take):]
+                if self.count == self.n:
+                    out.append((self.anchor_id, time.time(), np.concatenate(self.pending)))
+                    self.pending, self.count = [], 0
+        return out
+
+
+class CIRStore:
+    """
+    預先配置的記憶體映射 .npy（CIR_DTYPE 結構陣列），每收到一筆 CIR 直接寫入下一列。
+    已存在的檔案會接著寫；t == 0 的列是尚未使用的空位。
+    """
+
+    def __init__(self, path, capacity=CAPACITY):
+        self.path = path
+        if os.path.exists(path):
+            self.data = open_memmap(path, mode='r+')
+            used = self.data['t'] > 0
+            self.n = len(used) if used.all() else int(np.argmin(used))
+        else:
+            self.data = open_memmap(path, mode='w+', dtype=CIR_DTYPE, shape=(capacity,))
+            self.n = 0
+
+    @property
+    def full(self):
+        return self.n >= len(self.data)
+
+    def append(self, anchor_id, t, cir):
+        if self.full:
+            return False
+        row = self.data[self.n]
+        row['anchor'] = anchor_id.encode()[:16]
+        row['cir'] = cir
+        row['t'] = t                # 最後寫入時間，中斷時不會留下半筆資料
+        self.n += 1
+        return True
+
+    def flush(self):
+        self.data.flush()
+
+
+def load(path):
+    """讀取擷取檔中已寫入的 CIR（唯讀記憶體映射）"""
+    data = np.load(path, mmap_mode='r')
+    return data[data['t'] > 0]
+
+
+def capture(path, count=None, capacity=CAPACITY):
     try:
-        raw = ser.readline()
-        line = raw.decode(errors='ignore').strip()
+        ser = open_serial(COM_PORT, BAUD_RATE, timeout=0.1)
+        print(f"✅ 已連線至 {COM_PORT}（波特率：{BAUD_RATE}）")
     except Exception as e:
-        print(f"⚠️ 解碼錯誤：{e}")
-        continue
-
-    if line.startswith("ANCHOR_ID"):
-        anchor_id = line.split(":")[1]
-        cir_data = []
-        print(f"🛰️  偵測到 Anchor ID: {anchor_id}")
-    elif line.isdigit():
-        cir_data.append(int(line))
-        if len(cir_data) % 100 == 0:
-            print(f"📥 已接收 {len(cir_data)} / 1024 筆資料...")
-        if len(cir_data) == 1024:
-            print("✅ 成功接收 1024 筆 CIR 資料！")
-            break
-
-# ── 畫圖與儲存 ──
-plt.figure(figsize=(10, 4))
-plt.plot(cir_data)
-plt.title(f"CIR 波形 - Anchor {anchor_id}")
-plt.xlabel("樣本點")
-plt.ylabel("振幅")
-plt.grid(True)
-
-timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-output_path = os.path.join(OUTPUT_DIR, f"cir_anchor{anchor_id}_{timestamp}.png")
-plt.savefig(output_path)
-print(f"✅ 圖片已儲存：{output_path}")
-
-plt.show()
+        print(f"❌ 無法連線至 {COM_PORT}：{e}")
+        exit(1)
+
+    store = CIRStore(path, capacity)
+    parser = CIRParser()
+    print(f"📡 擷取 CIR 至 {path}（已有 {store.n} / {len(store.data)} 筆）")
+    saved = 0
+    last = time.monotonic()
+    try:
+        while not store.full and (count is None or saved < count):
+            for anchor_id, t, cir in parser.feed(ser.read(max(ser.in_waiting, READ_SIZE))):
+                if store.append(anchor_id, t, cir):
+                    saved += 1
+            if time.monotonic() - last > 1:
+                store.flush()
+                last = time.monotonic()
+                print(f"📥 已擷取 {saved} 筆（檔案共 {store.n} 筆）")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        store.flush()
+        ser.close()
+    if store.full:
+        print("⚠️ 檔案已滿，請換新的檔名或加大 --capacity")
+    print(f"✅ 本次擷取 {saved} 筆 CIR，已存至：{path}")
+
+
+def plot(path, indices=None, out_dir=OUTPUT_DIR):
+    """另外執行的繪圖步驟：指定 indices 時每筆各畫一張，否則畫全部擷取的熱圖"""
+    import matplotlib.pyplot as plt
+    data = load(path)
+    os.makedirs(out_dir, exist_ok=True)
+    name = os.path.splitext(os.path.basename(path))[0]
+    if indices:
+        for i in indices:
+            anchor_id = data['anchor'][i].decode()
+            plt.figure(figsize=(10, 4))
+            plt.plot(data['cir'][i])
+            plt.title(f"CIR 波形 - Anchor {anchor_id}")
+            plt.xlabel("樣本點")
+            plt.ylabel("振幅")
+            plt.grid(True)
+            stamp = datetime.fromtimestamp(data['t'][i]).strftime("%Y%m%d_%H%M%S")
+            output_path = os.path.join(out_dir, f"cir_anchor{anchor_id}_{stamp}_{i}.png")
+            plt.savefig(output_path)
+            plt.close()
+            print(f"✅ 圖片已儲存：{output_path}")
+    else:
+        plt.figure(figsize=(10, 6))
+        plt.imshow(data['cir'], aspect='auto', interpolation='nearest', cmap='viridis')
+        plt.colorbar(label="振幅")
+        plt.title(f"CIR 擷取 {name}（{len(data)} 筆）")
+        plt.xlabel("樣本點")
+        plt.ylabel("擷取序號")
+        output_path = os.path.join(out_dir, f"{name}_cir_map.png")
+        plt.savefig(output_path)
+        plt.close()
+        print(f"✅ 圖片已儲存：{output_path}")
+
+
+if __name__ == '__main__':
+    ap = argparse.ArgumentParser(description="CIR 擷取（capture）與繪圖（plot）")
+    sub = ap.add_subparsers(dest='cmd')
+    cap = sub.add_parser('capture', help='從串口連續擷取 CIR 至 .npy')
+    cap.add_argument('path', nargs='?', help='輸出 .npy，預設 OUTPUT_DIR/cir_<時間>.npy；已存在則接著寫')
+    cap.add_argument('--count', type=int, default=None, help='擷取筆數，預設直到檔案滿或 Ctrl-C')
+    cap.add_argument('--capacity', type=int, default=CAPACITY)
+    plo = sub.add_parser('plot', help='畫出擷取檔中的 CIR')
+    plo.add_argument('path')
+    plo.add_argument('--index', type=int, nargs='*', help='要畫的筆數序號，省略則畫全部的熱圖')
+    plo.add_argument('--out', default=OUTPUT_DIR)
+    ap.set_defaults(cmd='capture', path=None, count=None, capacity=CAPACITY)
+    args = ap.parse_args()
+
+    if args.cmd == 'plot':
+        plot(args.path, args.index, args.out)
+    else:
+        path = args.path or os.path.join(OUTPUT_DIR, datetime.now().strftime("cir_%Y%m%d_%H%M%S.npy"))
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        capture(path, args.count, args.capacity)
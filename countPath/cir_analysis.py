@@ -0,0 +1,208 @@
+"""
+Vectorized channel impulse response (CIR) analysis and NLOS scoring.
+
+analyze() takes a stack of CIR captures, shape (N, 1024), and computes the
+features of every capture in one NumPy pass:
+
+    first_path    leading-edge index (sub-sample), where the amplitude first
+                  crosses the noise / peak threshold in the window before the peak
+    peak_ratio    peak amplitude / first-path amplitude (1 for a clean LOS pulse)
+    rise_time     samples from the leading edge to the peak
+    spread        RMS delay spread of the power after the first path (samples)
+    snr           peak amplitude / noise sigma
+    nlos          NLOS likelihood in [0, 1], nan when there is no usable pulse
+
+A weak first path followed by a much stronger, later peak and a long power
+tail is the NLOS signature; the score is a logistic of those three features.
+
+CIRMonitor keeps the newest score of every anchor and annotates range frames
+with it (RangeFrame.nlos), so the solver can down-weight suspect anchors.
+CIRReader fills a monitor from a CIR port in its own thread, so the range
+stream never waits on it. Archived captures (cir.py capture) are analyzed with
+
+    python3 cir_analysis.py capture.npy [-o features.npy]
+"""
+import argparse
+import time
+from threading import Thread, Event
+
+import numpy as np
+
+import cir as cir_capture
+from uwb_capture import open_serial
+
+NOISE_K = 6.0       # leading edge: amplitude above NOISE_K noise sigmas ...
+PEAK_FRAC = 0.1     # ... and above this fraction of the peak
+SEARCH = 64         # samples before the peak searched for the leading edge
+FP_WIN = 3          # first-path amplitude: max over this many samples from the edge
+SNR_MIN = 10.0      # below this peak SNR there is no usable pulse, nlos = nan
+# logistic NLOS model: z = log2(peak_ratio) + (rise - RISE_LOS) / RISE_SCALE + (spread - SPREAD_LOS) / SPREAD_SCALE + BIAS
+RISE_LOS, RISE_SCALE = 3.0, 6.0
+SPREAD_LOS, SPREAD_SCALE = 8.0, 12.0
+BIAS = -1.0
+MAX_AGE = 2.0       # a CIR older than this (s) no longer describes the anchor's range
+
+FEATURES_DTYPE = np.dtype([('first_path', '<f8'), ('peak_ratio', '<f8'), ('rise_time', '<f8'),
+                           ('spread', '<f8'), ('snr', '<f8'), ('nlos', '<f8')])
+
+
+def analyze(cirs):
+    # cirs: (N, L) or (L,) amplitudes -> (N,) or scalar FEATURES_DTYPE record(s)
+    cirs = np.asarray(cirs, dtype=float)
+    single = cirs.ndim == 1
+    x = np.atleast_2d(cirs)
+    n, length = x.shape
+    rows = np.arange(n)
+    idx = np.arange(length)
+
+    # the pulse occupies a small part of the window, so median / MAD give the noise floor
+    floor = np.median(x, axis=1, keepdims=True)
+    sigma = 1.4826 * np.median(np.abs(x - floor), axis=1) + 1e-9
+    x = np.maximum(x - floor, 0.0)
+    peak_idx = x.argmax(axis=1)
+    peak = x[rows, peak_idx]
+
+    thr = np.maximum(NOISE_K * sigma, PEAK_FRAC * peak)
+    window = (idx >= (peak_idx - SEARCH)[:, None]) & (idx <= peak_idx[:, None])
+    edge = ((x > thr[:, None]) & window).argmax(axis=1)
+    # interpolate the threshold crossing between edge - 1 and edge
+    prev = x[rows, np.maximum(edge - 1, 0)]
+    cur = x[rows, edge]
+    frac = np.where((edge > 0) & (cur > prev), (thr - prev) / np.maximum(cur - prev, 1e-9), 1.0)
+    first = edge - 1 + np.clip(frac, 0.0, 1.0)
+
+    fp_amp = x[rows[:, None], np.minimum(edge[:, None] + np.arange(FP_WIN), length - 1)].max(axis=1)
+    peak_ratio = peak / np.maximum(fp_amp, 1e-9)
+    rise = peak_idx - first
+
+    # RMS delay spread of the power from the first path on
+    p = x * x * (idx >= edge[:, None])
+    total = np.maximum(p.sum(axis=1), 1e-9)
+    delay = idx - first[:, None]
+    mean = (p * delay).sum(axis=1) / total
+    spread = np.sqrt(np.maximum((p * delay * delay).sum(axis=1) / total - mean * mean, 0.0))
+
+    snr = peak / sigma
+    z = (np.log2(peak_ratio) + (rise - RISE_LOS) / RISE_SCALE
+         + (spread - SPREAD_LOS) / SPREAD_SCALE + BIAS)
+    nlos = np.where(snr >= SNR_MIN, 1 / (1 + np.exp(-z)), np.nan)
+
+    out = np.empty(n, dtype=FEATURES_DTYPE)
+    out['first_path'] = first
+    out['peak_ratio'] = peak_ratio
+    out['rise_time'] = rise
+    out['spread'] = spread
+    out['snr'] = snr
+    out['nlos'] = nlos
+    return out[0] if single else out
+
+
+def analyze_file(path, chunk=4096):
+    # features of every capture in a cir.py capture file, in chunks to bound memory
+    data = cir_capture.load(path)
+    features = np.empty(len(data), dtype=FEATURES_DTYPE)
+    for start in range(0, len(data), chunk):
+        features[start:start + chunk] = analyze(data['cir'][start:start + chunk])
+    return data, features
+
+
+class CIRMonitor:
+    """
+    Newest NLOS score of every anchor. update() is called with each analyzed
+    batch; annotate() only does dictionary lookups, so it is cheap enough for
+    the range path. Scores older than `max_age` are ignored.
+    """
+
+    def __init__(self, max_age=MAX_AGE):
+        self.max_age = max_age
+        self.latest = {}        # anchor ID -> (t, features record)
+
+    def update(self, anchor_IDs, ts, cirs):
+        features = analyze(np.asarray(cirs).reshape(len(anchor_IDs), -1))
+        latest = dict(self.latest)
+        for anchor_ID, t, f in zip(anchor_IDs, ts, features):
+            if anchor_ID not in latest or latest[anchor_ID][0] <= t:
+                latest[anchor_ID] = (t, f)
+        self.latest = latest    # swapped, never modified in place
+        return features
+
+    def score(self, anchor_ID, now=None):
+        entry = self.latest.get(anchor_ID)
+        if entry is None:
+            return None
+        if now is None:
+            now = time.time()
+        t, f = entry
+        if now - t > self.max_age or not np.isfinite(f['nlos']):
+            return None
+        return float(f['nlos'])
+
+    def annotate(self, frames, now=None):
+        if not self.latest:
+            return frames
+        if now is None:
+            now = time.time()
+        return [frame._replace(nlos=self.score(frame.anchor_ID, now)) for frame in frames]
+
+
+class CIRReader(Thread):
+    """
+    Reads CIR blocks from their own serial port into a CIRMonitor (and
+    optionally a cir.CIRStore archive), off the range-reading thread.
+    """
+
+    def __init__(self, ser, monitor, store=None):
+        super().__init__(daemon=True)
+        self.ser = ser
+        self.monitor = monitor
+        self.store = store
+        self.parser = cir_capture.CIRParser()
+        self._halt = Event()
+
+    @classmethod
+    def open(cls, port, monitor, baud=cir_capture.BAUD_RATE, store=None):
+        return cls(open_serial(port, baud, timeout=0.1), monitor, store)
+
+    def run(self):
+        while not self._halt.is_set():
+            blocks = self.parser.feed(self.ser.read(max(self.ser.in_waiting, cir_capture.READ_SIZE)))
+            if not blocks:
+                continue
+            anchors, ts, cirs = zip(*blocks)
+            self.monitor.update(anchors, ts, np.stack(cirs))
+            if self.store is not None:
+                for block in blocks:
+                    self.store.append(*block)
+
+    def stop(self):
+        self._halt.set()
+
+
+if __name__ == '__main__':
+    ap = argparse.ArgumentParser(description='CIR features and NLOS scores of a cir.py capture file')
+    ap.add_argument('path')
+    ap.add_argument('-o', '--out', help='save the features (with t and anchor) to this .npy')
+    args = ap.parse_args()
+
+    start = time.perf_counter()
+    data, features = analyze_file(args.path)
+    elapsed = time.perf_counter() - start
+    print('{} captures analyzed in {:.1f} ms'.format(len(data), elapsed * 1e3))
+    for anchor in np.unique(data['anchor']):
+        sel = data['anchor'] == anchor
+        f = features[sel]
+        scored = np.isfinite(f['nlos'])
+        print('anchor {}: {} captures, first path {:.1f}, peak ratio {:.2f}, rise {:.1f}, spread {:.1f}, '
+              'NLOS mean {:.2f} ({:.0%} > 0.5)'.format(
+                  anchor.decode(), sel.sum(), np.nanmedian(f['first_path']), np.nanmedian(f['peak_ratio']),
+                  np.nanmedian(f['rise_time']), np.nanmedian(f['spread']),
+                  np.nanmean(f['nlos']) if scored.any() else np.nan,
+                  (f['nlos'][scored] > 0.5).mean() if scored.any() else 0.0))
+    if args.out:
+        out = np.empty(len(data), dtype=[('t', '<f8'), ('anchor', 'S16')] + FEATURES_DTYPE.descr)
+        out['t'] = data['t']
+        out['anchor'] = data['anchor']
+        for name in FEATURES_DTYPE.names:
+            out[name] = features[name]
+        np.save(args.out, out)
+        print('features saved to {}'.format(args.out))
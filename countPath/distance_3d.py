@@ -1,38 +1,218 @@
-import serial
+import itertools
+import time
 import numpy as np
+from uwb_frame import FrameParser
+from uwb_capture import open_serial
+from kalman import CVKalman
+
+
+class LinearSolver3D:
+    """
+    線性化最小平方多邊定位：A 只與固定的 anchor 座標有關，建構時先算好 pinv(A)，
+    之後每筆量測只需重建 b 並做一次矩陣乘法。支援任意數量 anchor 與 (N, anchors) 批次輸入。
+    """
+
+    def __init__(self, anchor_positions):
+        P = np.asarray(anchor_positions, dtype=float)
+        D = P[1:] - P[0]                       # 以 anchor 0 為原點
+        self.anchors = P
+        self.A = 2 * D
+        self.A_pinv = np.linalg.pinv(self.A)   # shape (3, anchors-1)
+        self.D2 = (D * D).sum(axis=1)
+
+    def solve(self, dists):
+        """dists: (anchors,) 或 (N, anchors) 距離 (m)，回傳 (3,) 或 (N, 3) 座標"""
+        R2 = np.square(np.asarray(dists, dtype=float))
+        b = R2[..., :1] - R2[..., 1:] + self.D2
+        return b @ self.A_pinv.T + self.anchors[0]
+
+
+class LMSolver3D:
+    """
+    批次 Levenberg–Marquardt 多邊定位，取代逐筆呼叫 scipy least_squares：
+    一次解 (N, anchors) 整批距離、座標夾在 [lower, upper] 內（預設非負）。每筆在步長或成本下降
+    小於 tol（相對值）時停止，最多 iterations 次；已收斂的筆數不再參與後續迭代。
+    solve_tags 以同一 tag 上一次的結果為初始值（warm start），通常幾次迭代就收斂。
+    weights 為每顆 anchor 殘差的權重（例如 1 - NLOS 機率，見 cir_analysis.py）。
+    """
+
+    def __init__(self, anchor_positions, iterations=100, lower=0.0, upper=np.inf, damping=1e-3, tol=1e-10):
+        self.anchors = np.asarray(anchor_positions, dtype=float)
+        self.iterations = iterations
+        self.tol = tol
+        self.lower = lower
+        self.upper = upper
+        self.damping = damping
+        self.linear = LinearSolver3D(anchor_positions)     # 沒有上一次結果時的初始值
+        self.last = {}                          # tag -> 上一次的座標
+
+    def cost(self, x, dists, w=1.0):
+        r = np.linalg.norm(x[:, None, :] - self.anchors[None], axis=2) - dists
+        return (w * r * r).sum(axis=1)
+
+    def solve(self, dists, x0=None, weights=None):
+        """dists: (anchors,) 或 (N, anchors)；x0: 初始值 (3,) 或 (N, 3)，預設為線性解；weights: 同 dists 形狀"""
+        dists = np.asarray(dists, dtype=float)
+        single = dists.ndim == 1
+        dists = np.atleast_2d(dists)
+        n, d = len(dists), self.anchors.shape[1]
+        w = np.ones_like(dists) if weights is None else np.broadcast_to(np.asarray(weights, dtype=float), dists.shape)
+        x = np.empty((n, d))
+        x[:] = self.linear.solve(dists) if x0 is None else x0
+        x = np.clip(x, self.lower, self.upper)
+        lam = np.full(n, self.damping)
+        cost = self.cost(x, dists, w)
+        eye = np.eye(d)
+        active = np.arange(n)                   # 尚未收斂的筆
+        for _ in range(self.iterations):
+            xa, da, wa, la, ca = x[active], dists[active], w[active], lam[active], cost[active]
+            diff = xa[:, None, :] - self.anchors[None]          # (N, anchors, 3)
+            r = np.maximum(np.linalg.norm(diff, axis=2), 1e-9)
+            J = diff / r[..., None]
+            res = r - da
+            JtJ = np.einsum('nk,nki,nkj->nij', wa, J, J)
+            g = np.einsum('nki,nk->ni', J, wa * res)
+            # 完整 Hessian（加上殘差的二階項）：z 方向很平時 Gauss–Newton 收斂太慢
+            k = wa * res / r
+            H = JtJ + k.sum(axis=1)[:, None, None] * eye - np.einsum('nk,nki,nkj->nij', k, J, J)
+            H = H + la[:, None, None] * (np.abs(H) * eye + eye * 1e-9)
+            # 已貼在邊界且梯度往外推的座標固定不動，其餘照常更新
+            free = ~(((xa <= self.lower) & (g > 0)) | ((xa >= self.upper) & (g < 0)))
+            H = H * (free[:, :, None] & free[:, None, :]) + eye * ~free[:, :, None]
+            step = np.linalg.solve(H, -(g * free)[..., None])[..., 0]
+            x_new = np.clip(xa + step, self.lower, self.upper)
+            cost_new = self.cost(x_new, da, wa)
+            better = cost_new < ca
+            x[active[better]] = x_new[better]
+            cost[active[better]] = cost_new[better]
+            lam[active] = np.where(better, la / 10, la * 10)
+            # 收斂：步長可忽略，或接受的步只讓成本下降可忽略的比例
+            moved = np.abs(x_new - xa).max(axis=1)
+            done = (moved <= self.tol * (1 + np.abs(xa).max(axis=1))) | (better & (ca - cost_new <= self.tol * ca))
+            active = active[~done]
+            if len(active) == 0:
+                break
+        return x[0] if single else x
+
+    def solve_tags(self, tags, dists, weights=None):
+        """多 tag：每個 tag 由自己的上一次座標開始，回傳 (N, 3) 並更新 last"""
+        dists = np.atleast_2d(np.asarray(dists, dtype=float))
+        x0 = self.linear.solve(dists)
+        for i, tag in enumerate(tags):
+            if tag in self.last:
+                x0[i] = self.last[tag]
+        x = self.solve(dists, x0, weights)
+        self.last.update(zip(tags, x.copy()))
+        return x
+
+
+class RANSACSolver3D:
+    """
+    RANSAC 排除 NLOS 距離：所有最小 anchor 子集（維度 + 1 顆）一次批次線性求解，
+    以其餘 anchor 的距離殘差計分（MSAC），取共識最佳的子集，再用它的 inlier 重新求解。
+    回傳座標與每顆 anchor 的 inlier 旗標。anchor 數需多於維度 + 1 才能偵測離群值。
+    """
+
+    def __init__(self, anchor_positions, threshold=0.5):
+        P = np.asarray(anchor_positions, dtype=float)
+        n, d = P.shape
+        self.anchors = P
+        self.threshold = threshold              # 殘差超過此值 (m) 視為 outlier
+        subsets = np.array(list(itertools.combinations(range(n), d + 1)))
+        D = P[subsets[:, 1:]] - P[subsets[:, :1]]                   # (K, d, d)
+        sv = np.linalg.svd(D, compute_uv=False)
+        ok = sv[:, -1] > 1e-6 * sv[:, 0]        # 跳過共面（退化）的子集，全退化時全部保留
+        if ok.any():
+            subsets, D = subsets[ok], D[ok]
+        self.subsets = subsets
+        self.pinv = np.linalg.pinv(2 * D)                           # (K, d, d)
+        self.D2 = (D * D).sum(axis=2)                               # (K, d)
+        self.solvers = {}                                           # inlier 組合 -> LinearSolver3D
+
+    def solve(self, dists):
+        """dists: (anchors,) 或 (N, anchors)，回傳 (座標 (N, d), inlier 旗標 (N, anchors))"""
+        dists = np.asarray(dists, dtype=float)
+        single = dists.ndim == 1
+        dists = np.atleast_2d(dists)
+        S = self.subsets
+        R2 = dists * dists
+        b = R2[:, S[:, :1]] - R2[:, S[:, 1:]] + self.D2             # (N, K, d)
+        X = np.einsum('kij,nkj->nki', self.pinv, b) + self.anchors[S[:, 0]]
+        res = np.abs(np.linalg.norm(X[:, :, None] - self.anchors, axis=3) - dists[:, None])  # (N, K, anchors)
+        score = np.minimum(res, self.threshold).sum(axis=2)
+        best = score.argmin(axis=1)
+        rows = np.arange(len(dists))
+        inliers = res[rows, best] < self.threshold
+        pos = X[rows, best]
+        # 用各列的 inlier 重新求解，相同 inlier 組合的列一起算
+        for mask in np.unique(inliers, axis=0):
+            if mask.sum() <= self.anchors.shape[1] + 1:
+                continue
+            key = tuple(mask.tolist())
+            solver = self.solvers.get(key)
+            if solver is None:
+                solver = self.solvers[key] = LinearSolver3D(self.anchors[mask])
+            sel = (inliers == mask).all(axis=1)
+            pos[sel] = solver.solve(dists[sel][:, mask])
+        if single:
+            return pos[0], inliers[0]
+        return pos, inliers
+
 
 class UWB3DLocal:
-    def __init__(self, anchor_ids, anchor_positions, port='/dev/ttyUSB0', baud=57600):
+    def __init__(self, anchor_ids, anchor_positions, port='/dev/ttyUSB0', baud=57600, tag_offset=None, cir=None):
         assert len(anchor_ids) == len(anchor_positions), "ID 與座標數量必須相同"
         self.anchor_ids = anchor_ids
         self.anchors = np.array(anchor_positions)  # shape (4,3)
         self.dists   = np.zeros(len(anchor_ids))   # 量測距離 r_i（公尺）
-        self.ser = serial.Serial(port, baud, timeout=1)
+        self.nlos    = np.zeros(len(anchor_ids))   # 各距離的 NLOS 機率（有 CIR 時）
+        self.solver  = LinearSolver3D(anchor_positions)
+        self.robust  = RANSACSolver3D(anchor_positions)   # 排除 NLOS 距離用
+        self.weighted = LMSolver3D(anchor_positions)      # 依 CIR 的 NLOS 機率降低權重
+        self.cir     = cir                          # cir_analysis.CIRMonitor
+        self.kf      = CVKalman(3)                   # 追蹤模式用
+        self.tag_rows  = {}                         # 多 tag：tag -> tag_dists 的列
+        self.tag_dists = np.zeros((0, len(anchor_ids)))
+        self.parser  = FrameParser(anchor_ids, tag_offset)
+        self.ser = open_serial(port, baud, timeout=1)
 
     def UWB_read(self):
-        raw = self.ser.read(200).hex()
-        for i, aid in enumerate(self.anchor_ids):
-            idx = raw.find(aid)
-            if idx>=0:
-                hex_dis = raw[idx+16 : idx+24]
-                dis = int.from_bytes(bytes.fromhex(hex_dis)[::-1], 'big')
-                self.dists[i] = (dis if dis<32768 else 0) / 100.0
+        frames = self.parser.feed(self.ser.read(200))
+        if self.cir is not None:
+            frames = self.cir.annotate(frames)
+        for frame in frames:
+            self.dists[frame.index] = frame.dis
+            self.nlos[frame.index] = frame.nlos or 0.0
+            row = self.tag_rows.get(frame.tag)
+            if row is None:
+                row = self.tag_rows[frame.tag] = len(self.tag_rows)
+                self.tag_dists = np.vstack((self.tag_dists, np.zeros(len(self.anchor_ids))))
+            self.tag_dists[row, frame.index] = frame.dis
 
     def compute_3d(self):
-        P, R = self.anchors, self.dists
-        A, b = [], []
-        x0,y0,z0 = P[0]; r0 = R[0]
-        for i in range(1, len(P)):
-            xi, yi, zi = P[i]
-            ri = R[i]
-            A.append([2*(xi-x0), 2*(yi-y0), 2*(zi-z0)])
-            b.append((r0**2 - ri**2)
-                   + (xi**2 - x0**2)
-                   + (yi**2 - y0**2)
-                   + (zi**2 - z0**2))
-        A = np.vstack(A);  b = np.array(b)
-        p_rel, *_ = np.linalg.lstsq(A, b, rcond=None)
-        return tuple(p_rel + P[0])
+        return tuple(self.solver.solve(self.dists))
+
+    def compute_3d_robust(self):
+        """RANSAC 模式：回傳 (座標, 每顆 anchor 是否為 inlier)"""
+        pos, inliers = self.robust.solve(self.dists)
+        return tuple(pos), inliers.tolist()
+
+    def compute_3d_weighted(self):
+        """以 1 - NLOS 機率為權重的 LM 解，沒有 CIR 時等同一般最小平方"""
+        return tuple(self.weighted.solve(self.dists, weights=np.maximum(1 - self.nlos, 0.05)))
+
+    def compute_3d_tags(self):
+        """所有距離完整的 tag 一次批次求解，回傳 {tag: (x, y, z)}"""
+        tags = [tag for tag, row in self.tag_rows.items() if np.all(self.tag_dists[row] > 0)]
+        rows = [self.tag_rows[tag] for tag in tags]
+        return dict(zip(tags, map(tuple, self.solver.solve(self.tag_dists[rows]))))
+
+    def compute_3d_kalman(self, t=None):
+        """追蹤模式：有完整距離就更新濾波器，否則只做預測；回傳 (座標, 共變異數)"""
+        if t is None:
+            t = time.monotonic()
+        z = self.compute_3d() if np.all(self.dists > 0) else None
+        return self.kf.step(z, t)
 
 if __name__ == '__main__':
     anchor_IDs = [
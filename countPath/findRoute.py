@@ -1,60 +1,21 @@
+import heapq
+import itertools
 import json
+import os
+from collections import OrderedDict
+from threading import Lock
+import numpy as np
+from uwb_metrics import metrics
 
+POINTS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'points.json')
+START, DEST = 'st', 'dest'
+CACHE_SIZE = 256
+CACHE_CELL = 0.00001    # start positions within the same cell (~1 m in lon/lat) share a route
+CORNER_EPS = np.array([[-1e-9, -1e-9], [-1e-9, 1e-9], [1e-9, -1e-9], [1e-9, 1e-9]])     # in cells
 
-class Graph:
-    def __init__(self, size):
-        self.adj_matrix = [[0] * size for _ in range(size)]
-        self.size = size
-        self.vertex_data = [[]] * size
-
-    def add_edge(self, u, v, weight):
-        if 0 <= u < self.size and 0 <= v < self.size:
-            self.adj_matrix[u][v] = weight
-            self.adj_matrix[v][u] = weight  # For undirected graph
-
-    def add_vertex_data(self, vertex, data):
-        if 0 <= vertex < self.size:
-            self.vertex_data[vertex] = data
-
-    def dijkstra(self, start_vertex_data):
-        start_vertex = self.vertex_data.index(start_vertex_data)
-        distances = [float('inf')] * self.size
-        distances[start_vertex] = 0
-        visited = [False] * self.size
-
-        tempRoute = []
-        nodeList = [i for i in range(self.size)]
-        for _ in range(self.size):
-            min_distance = float('inf')
-            u = None
-            for i in range(self.size):
-                if not visited[i] and distances[i] < min_distance:
-                    min_distance = distances[i]
-                    u = i
-            tempRoute.append((nodeList[u], u))
-            if u is None:
-                break
-
-            visited[u] = True
-
-            for v in range(self.size):
-                if self.adj_matrix[u][v] != 0 and not visited[v]:
-                    alt = distances[u] + self.adj_matrix[u][v]
-                    if alt < distances[v]:
-                        distances[v] = alt
-                        nodeList[v] = u
-
-        target = 9
-        route = [target]
-        for i in range(len(tempRoute)-1, -1, -1):
-            if tempRoute[i][1] == target:
-                target = tempRoute[i][0]
-                route.append(target)
-            if target == 0:
-                break
-        print(route)
-
-        return route
+
+def distance(A, B):
+    return ((A[0] - B[0])**2 + (A[1] - B[1])**2)**0.5
 
 # check if two lines intersect
 
@@ -80,25 +41,224 @@ def checkIntersection(A, B, C, D):
         return True
     return False
 
-# add edge between st and dst if there is no intersection
 
+class WallIndex:
+    # uniform grid over the obstacle walls; a segment is only tested against walls in the cells it crosses
+    def __init__(self, walls, cell=None):
+        self.walls = np.asarray(walls, dtype=float).reshape(-1, 2, 2)     # (M, 2 ends, xy)
+        self.grid = {}
+        if len(self.walls) == 0:
+            return
+        lo = self.walls.min(axis=1)
+        hi = self.walls.max(axis=1)
+        if cell is None:
+            cell = np.linalg.norm(self.walls[:, 1] - self.walls[:, 0], axis=1).mean()
+        self.cell = cell if cell > 0 else 1.0
+        self.origin = lo.min(axis=0)
+        c0 = self.cells(lo)
+        c1 = self.cells(hi)
+        cells = {}
+        for m in range(len(self.walls)):
+            for cx in range(c0[m, 0], c1[m, 0] + 1):
+                for cy in range(c0[m, 1], c1[m, 1] + 1):
+                    cells.setdefault((cx, cy), []).append(m)
+        self.grid = {key: np.array(idx) for key, idx in cells.items()}
+
+    def cells(self, p):
+        return np.floor((np.asarray(p) - self.origin) / self.cell).astype(int)
+
+    def candidates(self, A, B):
+        # supercover of A-B, O(length / cell): the cell of every piece between two grid-line crossings,
+        # plus the cells around every crossing and end point (a line through a corner touches all four)
+        p = (np.asarray(A, dtype=float) - self.origin) / self.cell
+        d = (np.asarray(B, dtype=float) - self.origin) / self.cell - p
+        ts = [np.array([0.0, 1.0])]
+        for axis in range(2):
+            if d[axis] != 0:
+                lo, hi = sorted((p[axis], p[axis] + d[axis]))
+                ts.append((np.arange(np.floor(lo) + 1, np.ceil(hi)) - p[axis]) / d[axis])
+        ts = np.sort(np.concatenate(ts))
+        cross = p + ts[:, None] * d
+        mid = p + ((ts[:-1] + ts[1:]) / 2)[:, None] * d
+        pts = np.concatenate((mid, (cross[:, None] + CORNER_EPS).reshape(-1, 2)))
+        cx, cy = np.floor(pts).astype(int).T.tolist()
+        found = [self.grid[key] for key in set(zip(cx, cy)) if key in self.grid]
+        if not found:
+            return None
+        return np.unique(np.concatenate(found))
+
+    def intersects(self, A, B):
+        if not self.grid:
+            return False
+        idx = self.candidates(A, B)
+        if idx is None:
+            return False
+        return bool(segmentIntersections(A, B, self.walls[idx]).any())
+
+
+def segmentIntersections(A, B, walls):
+    # checkIntersection of A-B against every wall in (M, 2, 2) at once
+    C, D = walls[:, 0], walls[:, 1]
+    a1 = B[1] - A[1]
+    b1 = A[0] - B[0]
+    c1 = a1 * A[0] + b1 * A[1]
+
+    a2 = D[:, 1] - C[:, 1]
+    b2 = C[:, 0] - D[:, 0]
+    c2 = a2 * C[:, 0] + b2 * C[:, 1]
+
+    determinant = a1 * b2 - a2 * b1
+    with np.errstate(divide='ignore', invalid='ignore'):
+        x = (b2 * c1 - b1 * c2) / determinant
+        y = (a1 * c2 - a2 * c1) / determinant
+    return ((determinant != 0)
+            & (min(A[0], B[0]) <= x) & (x <= max(A[0], B[0]))
+            & (min(A[1], B[1]) <= y) & (y <= max(A[1], B[1]))
+            & (np.minimum(C[:, 0], D[:, 0]) <= x) & (x <= np.maximum(C[:, 0], D[:, 0]))
+            & (np.minimum(C[:, 1], D[:, 1]) <= y) & (y <= np.maximum(C[:, 1], D[:, 1])))
+
+
+class NavMap:
+    # cross nodes, obstacle boxes and the cross-to-cross edges, built once from points.json
+    def __init__(self, path=POINTS_PATH):
+        self.path = path
+        self.mtime = None
+        self.lock = Lock()
+        self.refresh()
+
+    def refresh(self):
+        # reload only when the file changed; returns True if it did
+        mtime = os.path.getmtime(self.path)
+        if mtime == self.mtime:
+            return False
+        with self.lock:
+            if mtime != self.mtime:
+                self.load()
+                self.mtime = mtime
+        return True
+
+    def load(self):
+        with open(self.path, 'r') as file:
+            data = json.load(file)
+
+        nodes = {node['id']: node['pos'] for node in data['cross']}
+        walls = []
+        for box in data['box']:
+            for k in range(4):
+                walls.append((box['edge'][k], box['edge'][(k+1) % 4]))
+
+        # static edges: listed in the file, or the original grid rule
+        # (neighbouring ids and ids 4 apart, except 4-5)
+        if 'edges' in data:
+            pairs = data['edges']
+        else:
+            ids = sorted(nodes)
+            pairs = [(i, k) for i in ids for k in ids
+                     if i < k and k - i in (1, 4) and (i, k) != (4, 5)]
+        adj = {i: [] for i in nodes}
+        for i, k in pairs:
+            w = distance(nodes[i], nodes[k])
+            adj[i].append((k, w))
+            adj[k].append((i, w))
+        self.nodes, self.walls, self.adj = nodes, WallIndex(walls), adj
+
+    def visible(self, A, B):
+        return not self.walls.intersects(A, B)
+
+    def route(self, st, dest):
+        return self.positions(self.plan(st, dest), st, dest)
+
+    def positions(self, path, st, dest):
+        # original order: destination first
+        pos = {START: st, DEST: dest}
+        return [pos[i] if i in pos else self.nodes[i] for i in reversed(path)]
+
+    def plan(self, st, dest):
+        nodes, adj = self.nodes, self.adj
+        pos = dict(nodes)
+        pos[START], pos[DEST] = st, dest
+        # start and destination only get per-request edges, the static graph is untouched
+        extra = {START: [], DEST: []}
+        if self.visible(st, dest):
+            w = distance(st, dest)
+            extra[START].append((DEST, w))
+        for i, p in nodes.items():
+            for end in (START, DEST):
+                if self.visible(pos[end], p):
+                    w = distance(pos[end], p)
+                    extra[end].append((i, w))
+                    extra.setdefault(i, []).append((end, w))
+        return astar(pos, adj, extra, START, DEST)
+
+
+def astar(pos, adj, extra, start, target):
+    # binary-heap A* with the euclidean distance to the target as heuristic
+    goal = pos[target]
+    dist = {start: 0}
+    prev = {}
+    tie = itertools.count()     # node ids of mixed types are never compared
+    heap = [(distance(pos[start], goal), 0, next(tie), start)]
+    done = set()
+    while heap:
+        _, d, _, u = heapq.heappop(heap)
+        if u in done:
+            continue
+        if u == target:
+            path = [u]
+            while u in prev:
+                u = prev[u]
+                path.append(u)
+            return path[::-1]
+        done.add(u)
+        for v, w in adj.get(u, []) + extra.get(u, []):
+            alt = d + w
+            if v not in done and alt < dist.get(v, float('inf')):
+                dist[v] = alt
+                prev[v] = u
+                heapq.heappush(heap, (alt + distance(pos[v], goal), alt, next(tie), v))
+    return []
+
+
+class RouteCache:
+    # bounded LRU of node paths keyed by destination and the snapped start cell
+    def __init__(self, size=CACHE_SIZE, cell=CACHE_CELL):
+        self.size = size
+        self.cell = cell
+        self.hits = 0
+        self.misses = 0
+        self.lock = Lock()
+        self.paths = OrderedDict()
+
+    def key(self, st, dest):
+        return (tuple(dest), round(st[0] / self.cell), round(st[1] / self.cell))
+
+    def get(self, key):
+        with self.lock:
+            path = self.paths.get(key)
+            if path is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self.paths.move_to_end(key)
+            return path
+
+    def put(self, key, path):
+        with self.lock:
+            self.paths[key] = path
+            self.paths.move_to_end(key)
+            if len(self.paths) > self.size:
+                self.paths.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.paths.clear()
 
-def addEdge(st, dst, data):
-    inter = False
-    for box in data['box']:
-        if (inter):  # if intersection found
-            break
-        for k in range(4):
+    def stats(self):
+        return {'size': len(self.paths), 'hits': self.hits, 'misses': self.misses}
 
-            if (checkIntersection(graph.vertex_data[st], graph.vertex_data[dst], box['edge'][k], box['edge'][(k+1) % 4])):
-                graph.add_edge(st, dst, 0)
-                inter = True
-                break
 
-    if (not inter):
-        len = ((graph.vertex_data[st][0] - graph.vertex_data[dst][0])**2 +
-               (graph.vertex_data[st][1] - graph.vertex_data[dst][1])**2)**0.5
-        graph.add_edge(st, dst, len)
+navmap = None
+route_cache = RouteCache()
 
 
 def findRoute(st=[], dest=[]):
@@ -106,43 +266,19 @@ def findRoute(st=[], dest=[]):
     if dest == []:
         return []
 
-    # st = [121.5444944, 25.01802]
-
-    global graph
-    graph = Graph(10)
-
-    # load information from json file
-    with open('points.json', 'r') as file:
-        data = json.load(file)
-
-    # add vertex data
-    graph.add_vertex_data(0, st)
-    graph.add_vertex_data(9, dest)
-    for node in data['cross']:
-        graph.add_vertex_data(node['id'], node['pos'])
-
-    # add edges (original cross)
-    for i in range(1, 9):
-        for k in range(i + 1, 9):
-            if k-i == 1 or k-i == 4:
-                if k != 5 or i != 4:
-                    print(i, k)
-                    len = ((graph.vertex_data[i][0] - graph.vertex_data[k][0])**2 +
-                           (graph.vertex_data[i][1] - graph.vertex_data[k][1])**2)**0.5
-                    graph.add_edge(i, k, len)
-            else:
-                graph.add_edge(i, k, 0)
-    print(graph.adj_matrix)
-    # add edges (st and dest)
-    addEdge(0, 9, data)
-    for i in range(1, 9):
-        addEdge(0, i, data)
-        addEdge(9, i, data)
-    route = graph.dijkstra(st)
-    finalRoute = []
-    for i in route:
-        finalRoute.append(graph.vertex_data[i])
-
+    global navmap
+    with metrics.timer('route'):
+        if navmap is None:
+            navmap = NavMap()
+        elif navmap.refresh():
+            route_cache.clear()     # points.json changed
+
+        key = route_cache.key(st, dest)
+        path = route_cache.get(key)
+        if path is None:
+            path = navmap.plan(st, dest)
+            route_cache.put(key, path)
+        finalRoute = navmap.positions(path, st, dest)
     print(finalRoute)
     return finalRoute
 
@@ -0,0 +1,81 @@
+"""
+Vectorized GDOP for an anchor layout, over a whole floor grid at once.
+
+GDOPGrid evaluates every grid point in one batch (np.linalg.inv over an
+(N, d, d) stack), caches the result to a .npy file keyed by the anchor
+geometry and the grid, and looks a position up in O(1).
+
+    grid = GDOPGrid(anchors)            # (n, 2) or (n, 3) anchor positions in m
+    grid.lookup((x, y))                 # GDOP at a fix
+    grid.lookup_batch(fixes)            # (N,) for (N, d) fixes
+"""
+import hashlib
+import os
+
+import numpy as np
+
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'gdop_cache')
+STEP = 0.1          # grid spacing (m)
+MARGIN = 5.0        # grid extends this far beyond the anchors (m)
+
+
+def gdop_batch(anchors, points):
+    # anchors (n, d), points (N, d) -> (N,) GDOP; inf where the geometry is singular
+    anchors = np.asarray(anchors, dtype=float)
+    points = np.atleast_2d(np.asarray(points, dtype=float))
+    diffs = anchors[None] - points[:, None]                 # (N, n, d)
+    dists = np.linalg.norm(diffs, axis=2)
+    G = diffs / np.maximum(dists, 1e-9)[..., None]
+    GtG = np.einsum('nki,nkj->nij', G, G)                   # (N, d, d)
+    singular = np.abs(np.linalg.det(GtG)) < 1e-12
+    GtG[singular] = np.eye(anchors.shape[1])
+    Q = np.linalg.inv(GtG)
+    gdop = np.sqrt(np.trace(Q, axis1=1, axis2=2))
+    gdop[singular] = np.inf
+    return gdop
+
+
+class GDOPGrid:
+    def __init__(self, anchors, lo=None, hi=None, step=STEP, cache_dir=CACHE_DIR):
+        self.anchors = np.asarray(anchors, dtype=float)
+        d = self.anchors.shape[1]
+        self.lo = self.anchors.min(axis=0) - MARGIN if lo is None else np.asarray(lo, dtype=float)
+        self.hi = self.anchors.max(axis=0) + MARGIN if hi is None else np.asarray(hi, dtype=float)
+        self.step = step
+        self.shape = tuple(int(n) for n in np.floor((self.hi - self.lo) / step + 1e-9) + 1)
+        self.path = os.path.join(cache_dir, 'gdop_{}d_{}.npy'.format(d, self.key())) if cache_dir else None
+        if self.path and os.path.exists(self.path):
+            self.values = np.load(self.path)
+        else:
+            self.values = self.compute()
+            if self.path:
+                os.makedirs(cache_dir, exist_ok=True)
+                np.save(self.path, self.values)
+
+    def key(self):
+        # anchor geometry (to the mm) and grid -> cache file name
+        h = hashlib.sha1()
+        for a in (np.round(self.anchors, 3), np.round(self.lo, 3), np.round(self.hi, 3), [self.step]):
+            h.update(np.ascontiguousarray(a, dtype=float).tobytes())
+        return h.hexdigest()[:16]
+
+    def axes(self):
+        return [self.lo[i] + self.step * np.arange(n) for i, n in enumerate(self.shape)]
+
+    def points(self):
+        return np.stack(np.meshgrid(*self.axes(), indexing='ij'), axis=-1).reshape(-1, len(self.shape))
+
+    def compute(self):
+        return gdop_batch(self.anchors, self.points()).reshape(self.shape)
+
+    def index(self, pos):
+        # nearest grid cell; positions outside the grid take the edge value
+        i = np.rint((np.asarray(pos, dtype=float) - self.lo) / self.step).astype(int)
+        return np.clip(i, 0, np.array(self.shape) - 1)
+
+    def lookup(self, pos):
+        return float(self.values[tuple(self.index(pos))])
+
+    def lookup_batch(self, pos):
+        idx = self.index(np.atleast_2d(pos))
+        return self.values[tuple(idx.T)]
@@ -29,14 +29,28 @@ matplotlib.use('Agg')
 import matplotlib.pyplot as plt
 
 from read_GIPS_distance import UWBpos
+from gdop import GDOPGrid, gdop_batch
 
 def compute_gdop(anchors: np.ndarray, x_tag: float, y_tag: float) -> float:
     """計算2D GDOP"""
-    diffs = anchors - np.array([x_tag, y_tag])
-    dists = np.linalg.norm(diffs, axis=1)
-    G = diffs / dists[:, None]
-    Q = np.linalg.inv(G.T @ G)
-    return np.sqrt(np.trace(Q))
+    return float(gdop_batch(anchors, [(x_tag, y_tag)])[0])
+
+
+def plot_gdop_map(anchors: np.ndarray, path: str = 'gdop_map.png'):
+    """整個場地的 GDOP 熱圖（一次批次計算，結果快取於 gdop_cache/）"""
+    grid = GDOPGrid(anchors)
+    xs, ys = grid.axes()
+    plt.figure(figsize=(6,5))
+    mesh = plt.pcolormesh(xs, ys, np.minimum(grid.values, 10).T, cmap='viridis', shading='auto')
+    plt.colorbar(mesh, label='GDOP (capped at 10)')
+    plt.scatter(anchors[:,0], anchors[:,1], c='red', marker='x', label='Anchors')
+    plt.legend()
+    plt.xlabel('X (m) relative to Anchor6')
+    plt.ylabel('Y (m) relative to Anchor6')
+    plt.title('GDOP map')
+    plt.tight_layout()
+    plt.savefig(path)
+    print(f"已儲存圖檔：{path}")
 
 def main():
     # --- 1. 載入測點清單 ---
@@ -55,16 +69,21 @@ def main():
 
         input(f"\n請將 Tag 放在點 {pid} (x={x_true:.2f}, y={y_true:.2f})，按 Enter 開始量測…")
 
-        # 重複量測多次平均
+        # 丟掉等待期間累積的舊資料，再重複量測多次平均
+        uwb.flush()
+        # 只平均三個 anchor 都有回報的量測，最多嘗試 3 倍次數
         n_meas = 10
-        xs, ys = [], []
-        for i in range(n_meas):
-            uwb.UWB_read()
-            x_rel, y_rel = uwb.compute_relative()
-            xs.append(x_rel)
-            ys.append(y_rel)
-        x_meas = np.mean(xs)
-        y_meas = np.mean(ys)
+        diss = []
+        for _ in range(3 * n_meas):
+            d, mask = uwb.UWB_read_deadline()
+            if mask.all():
+                diss.append(d)
+                if len(diss) == n_meas:
+                    break
+        if not diss:
+            print(f"⚠️ 點 {pid} 沒有收到完整的三個 anchor 距離，跳過")
+            continue
+        x_meas, y_meas = uwb.compute_relative_batch(np.array(diss)).mean(axis=0)
 
         # 計算 GDOP & 誤差
         gdop_true = compute_gdop(anchors, x_true, y_true)
@@ -102,5 +121,8 @@ def main():
     plt.savefig('gdop_at_true_points.png')
     print("已儲存圖檔：gdop_at_true_points.png")
 
+    # --- 6. 整個場地的 GDOP 熱圖 ---
+    plot_gdop_map(anchors)
+
 if __name__ == '__main__':
     main()
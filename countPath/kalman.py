@@ -0,0 +1,75 @@
+import numpy as np
+
+
+class CVKalman:
+    """
+    Constant-velocity Kalman filter on position fixes (2D or 3D).
+
+    State is [position, velocity]. `update` takes a solved position,
+    `predict` moves the state forward when a range set is missing.
+    Times are in seconds (time.monotonic()), positions in metres.
+    """
+
+    def __init__(self, dim=2, accel_std=0.5, meas_std=0.2, vel_std=1.0):
+        self.dim = dim
+        self.accel_var = accel_std ** 2
+        self.R = np.eye(dim) * meas_std ** 2
+        self.vel_var = vel_std ** 2
+        self.x = None
+        self.P = None
+        self.t = None
+
+    @property
+    def ready(self):
+        return self.x is not None
+
+    @property
+    def position(self):
+        return self.x[:self.dim]
+
+    @property
+    def covariance(self):
+        return self.P[:self.dim, :self.dim]
+
+    def reset(self):
+        self.x = self.P = self.t = None
+
+    def predict(self, t):
+        dt = t - self.t
+        if dt <= 0:
+            return
+        n = self.dim
+        F = np.eye(2 * n)
+        F[:n, n:] = np.eye(n) * dt
+        # white-noise acceleration
+        Q = self.accel_var * np.kron([[dt**4 / 4, dt**3 / 2], [dt**3 / 2, dt**2]], np.eye(n))
+        self.x = F @ self.x
+        self.P = F @ self.P @ F.T + Q
+        self.t = t
+
+    def update(self, z, t, scale=1.0):
+        # scale: measurement variance multiplier for this fix, e.g. (GDOP / reference GDOP)^2
+        z = np.asarray(z, dtype=float)
+        n = self.dim
+        if self.x is None:
+            self.x = np.concatenate((z, np.zeros(n)))
+            self.P = np.zeros((2 * n, 2 * n))
+            self.P[:n, :n] = self.R * scale
+            self.P[n:, n:] = np.eye(n) * self.vel_var
+            self.t = t
+            return
+        self.predict(t)
+        S = self.P[:n, :n] + self.R * scale
+        K = self.P[:, :n] @ np.linalg.inv(S)
+        self.x = self.x + K @ (z - self.x[:n])
+        self.P = self.P - K @ self.P[:n, :]
+
+    def step(self, z, t, scale=1.0):
+        # one frame: update with the fix, or only predict if the frame is missing (z is None)
+        if z is not None:
+            self.update(z, t, scale)
+        elif self.ready:
+            self.predict(t)
+        if not self.ready:
+            return None, None
+        return self.position.copy(), self.covariance.copy()
@@ -1,5 +1,3 @@
-import serial
-import binascii
 import numpy as np
 import pandas as pd
 import matplotlib
@@ -8,6 +6,8 @@ import matplotlib.pyplot as plt
 import os
 import time
 from datetime import datetime
+from uwb_frame import FrameParser
+from uwb_capture import open_serial
 
 # ---------- UWB 設定 ----------
 COM_PORT = '/dev/ttyUSB0'
@@ -15,31 +15,16 @@ BAUD_RATE = 57600
 ANCHOR_ID = '0241000000000000'
 MEASURE_TIMES = 20
 
-# ---------- 位元轉換 ----------
-def swap_endian(hexstring):
-    ba = bytearray.fromhex(hexstring)
-    ba.reverse()
-    return ba.hex()
+parser = FrameParser([ANCHOR_ID])
 
 # ---------- 讀取距離 ----------
 def read_distance(ser):
-    rx = ser.read(66)
-    rx = binascii.hexlify(rx).decode('utf-8')
-
-    if ANCHOR_ID in rx and rx.find(ANCHOR_ID) <= len(rx) - 24:
-        idx = rx.find(ANCHOR_ID)
-        raw_hex = rx[idx+16:idx+24]
-        swapped = swap_endian(raw_hex)
-        try:
-            val = int(swapped, 16)
-            
-            cm_val = val 
-            print(f"[DEBUG] HEX: {raw_hex} → Endian轉換: {swapped} → 十進位: {val} → 距離: {cm_val:.2f} cm")
-            return 0 if val >= 32768 else cm_val
-        except:
-            print("[ERROR] 轉換失敗")
-            return 0
-    return 0
+    frames = parser.feed(ser.read(66))
+    if not frames:
+        return 0
+    val = frames[-1].cm
+    print(f"[DEBUG] 十進位: {val} → 距離: {val:.2f} cm")
+    return 0 if val >= 32768 else val
 
 # ---------- 主測試與輸出 ----------
 def test_and_save(actual_distance_cm):
@@ -48,7 +33,7 @@ def test_and_save(actual_distance_cm):
     output_img = f"output/plot_uwb_result_{timestamp}.png"
 
     os.makedirs("output", exist_ok=True)
-    ser = serial.Serial(COM_PORT, BAUD_RATE, timeout=1)
+    ser = open_serial(COM_PORT, BAUD_RATE, timeout=1)
     time.sleep(2)
 
     distances = []
@@ -1,13 +1,28 @@
-import serial
-import binascii
 import numpy as np
 import random
+import time
+from collections import namedtuple
+from uwb_frame import FrameParser
+from uwb_capture import open_serial
+from kalman import CVKalman
+from uwb_metrics import metrics
 
 COM_PORT = '/dev/ttyUSB0'  # for rpi/wsl
 # COM_PORT = 'COM4'   # for computer
 
 anchor_IDs = ['0241000000000000', '0341000000000000', '0441000000000000','0541000000000000']
 BAUD_RATES = 57600
+FRAME_SIZE = 66     # bytes per anchor report
+TAG_OFFSET = None   # offset of the tag ID from the anchor ID in a frame; None = one tag per port
+READ_TIMEOUT = 0.05     # no serial read blocks longer than this (s)
+DEADLINE = 0.5          # time budget for one range set (s)
+FIX_DEADLINE = 2.0      # time budget for one averaged fix, UWB_read_compute_CRS_5 (s)
+MIN_ANCHORS = 2         # with fewer anchors in time there is no fix, the last one is returned as stale
+RECALIBRATE_TIMEOUT = 60.0
+
+# result of read_fix: CRS position (None before the first fix), anchors that reported,
+# 'complete' / 'degraded' (from MIN_ANCHORS or more) / 'stale' (last fix), time.time() of the fix
+PartialFix = namedtuple('PartialFix', ['pos', 'mask', 'status', 't'])
 
 # anchor position
 x0,  y0 = 25.1761218, 121.4515574  # CRS coordinate of anchor 6
@@ -19,15 +34,21 @@ _x_multiplier = 50000              # unit:(m/longitude)
 _y_multiplier = 50000              # unit:(m/latitude)
 x_multiplier = 55000              # unit:(m/longitude)
 y_multiplier = 55000              # unit:(m/latitude)
+multipliers = (x_multiplier, y_multiplier)   # read as one tuple so a recalibration swap is atomic
 x1, y1 = 0, 0                       # anchor 6
 x2, y2 = (x02 - x0) * _x_multiplier, (y02 - y0) * _y_multiplier   # anchor 7
 x3, y3 = (x03 - x0) * _x_multiplier, (y03 - y0) * _y_multiplier   # anchor 9
 
 
-def swapEndianness(hexstring):
-    ba = bytearray.fromhex(hexstring)
-    ba.reverse()
-    return ba.hex()
+def relative_to_CRS(rel):
+    # (..., 2) positions relative to anchor 6 (m) -> CRS coordinates
+    return np.array([x0, y0]) + np.asarray(rel) / np.array(multipliers)
+
+
+def set_multipliers(x, y):
+    global x_multiplier, y_multiplier, multipliers
+    multipliers = (x, y)
+    x_multiplier, y_multiplier = x, y
 
 
 class UWBpos:
@@ -38,7 +59,7 @@ class UWBpos:
         print("estimated anchor 6-7:{}".format((x2**2+y2**2)**(0.5)))
         print("estimated anchor 6-9:{}".format((x3**2+y3**2)**(0.5)))
         try:
-            self.ser_UWB = serial.Serial(COM_PORT, BAUD_RATES)
+            self.ser_UWB = open_serial(COM_PORT, BAUD_RATES, timeout=READ_TIMEOUT)
             self.ser_success = True
             print("Connected to {}".format(COM_PORT))
         except Exception as e:
@@ -50,35 +71,72 @@ class UWBpos:
         self.Y = np.array([y1, y2, y3])
         self.XY = np.cross(self.X, self.Y).dot(np.array([1, 1, 1]))
         self.C0 = np.array([(x1*x1 + y1*y1), (x2*x2 + y2*y2), (x3*x3 + y3*y3)])
+        # (x, y) = (C0 - r^2) @ K, the cross products of compute_relative folded into one matrix
+        ones = np.array([1, 1, 1])
+        self.K = np.column_stack((np.cross(self.Y, ones), np.cross(ones, self.X))) / self.XY / 2
         self.diss = np.zeros(3)
+        self.rx_t = np.zeros(3)                 # monotonic receive time of each diss
+        self.rx_seq = np.zeros(3, dtype=int)    # and its frame sequence number
+        self.parser = FrameParser(anchor_IDs[:len(self.diss)], TAG_OFFSET)
+        self.kf = CVKalman(2)       # tracking mode, see compute_CRS_kalman
+        self.last_rel = None        # last fix relative to anchor 6, prior of a degraded fix
+        self.last_fix = None        # last PartialFix with a position
+        self.stale = False          # read_fix has had no new position since last_fix
         print("UWB initialized successfully.")
         print("anchor 6 coordinate:({}, {})".format(x0, y0))
 
+    def flush(self):
+        # start a new measurement: drop bytes queued while nobody was reading and any partial frame
+        if self.ser_success:
+            metrics.inc('flushed_bytes', self.ser_UWB.in_waiting)
+            self.ser_UWB.reset_input_buffer()
+        self.parser.reset()
+
+    def UWB_read_frames(self):
+        # every frame queued on the port, of all tags
+        if not self.ser_success:
+            return []
+        with metrics.timer('serial_wait'):
+            rx = self.ser_UWB.read(max(self.ser_UWB.in_waiting, FRAME_SIZE * len(anchor_IDs)))
+        t = time.monotonic()
+        with metrics.timer('parse'):
+            frames = self.parser.feed(rx, t)
+        metrics.count_frames(frames)
+        return frames
+
     def UWB_read(self):
+        # one read of at most READ_TIMEOUT: anchors that have not reported yet stay 0,
+        # use UWB_read_deadline for a full set
         if self.ser_success:
-            self.ser_UWB.flushInput()
-            rx = self.ser_UWB.read(66 * len(anchor_IDs))
-            rx = binascii.hexlify(rx).decode('utf-8')
-
-            for index, anchor_ID in enumerate(anchor_IDs):
-                if (rx != ' ' and rx.find(anchor_ID) >= 0 and rx.find(anchor_ID) <= (len(rx)-24)):
-                    dis_index = rx.find(anchor_ID)
-                    dis = rx[dis_index + 16: dis_index + 24]  # ToF distance
-                    dis = swapEndianness(dis)
-
-                    if dis != "":
-                        dis = int(dis, 16)
-                        if dis >= 32768:      # solve sign
-                            dis = 0
-                        print("dis[{}] read: {}".format(index, dis))
-                    else:
-                        dis = 0
-                else:
-                    dis = 0
-                self.diss[index] = dis / 100
+            self.diss[:] = 0
+            # frames arrive in order, so the newest reading of each anchor wins
+            for frame in self.UWB_read_frames():
+                self.diss[frame.index] = frame.dis
+                self.rx_t[frame.index] = frame.t
+                self.rx_seq[frame.index] = frame.seq
+            if 0 in self.diss:
+                metrics.inc('incomplete_fixes')
+            for index, dis in enumerate(self.diss):
+                print("dis[{}] read: {}".format(index, dis))
 
         return self.diss
 
+    def UWB_read_deadline(self, deadline=DEADLINE):
+        # read until every anchor reported or `deadline` s passed; returns (diss, mask of anchors that reported)
+        end = time.monotonic() + deadline
+        self.diss[:] = 0
+        while self.ser_success:
+            for frame in self.UWB_read_frames():
+                self.diss[frame.index] = frame.dis
+                self.rx_t[frame.index] = frame.t
+                self.rx_seq[frame.index] = frame.seq
+            if 0 not in self.diss or time.monotonic() >= end:
+                break
+        mask = self.diss > 0
+        if not mask.all():
+            metrics.inc('deadline_misses')
+        return self.diss.copy(), mask
+
     def fake_read(self):
         random.seed()
         self.diss[0] = 10 * random.random()
@@ -87,63 +145,138 @@ class UWBpos:
         print(f"fake read: {self.diss[0]}, {self.diss[1]}, {self.diss[2]}")
 
     def compute_relative(self):
-        r1 = self.diss[0]
-        r2 = self.diss[1]
-        r3 = self.diss[2]
-        C = self.C0 - np.array([r1*r1, r2*r2, r3*r3])
-        CY = np.cross(C, self.Y).dot(np.array([1, 1, 1]))
-        XC = np.cross(self.X, C).dot(np.array([1, 1, 1]))
-        x = CY / self.XY / 2
-        y = XC / self.XY / 2
+        x, y = self.compute_relative_batch(self.diss[None, :])[0]
         return x, y
 
+    def compute_relative_batch(self, diss):
+        # diss: (N, 3) range triples in m -> (N, 2) positions relative to anchor 6
+        diss = np.asarray(diss, dtype=float)
+        return (self.C0 - diss * diss) @ self.K
+
+    def compute_relative_partial_batch(self, diss, mask, prior=None):
+        # (N, 3) ranges with (N, 3) masks of the valid ones -> (N, 2) relative positions, nan below 2 anchors.
+        # Two ranges leave two candidates (the circle intersections): the one nearest `prior`
+        # ((2,) or (N, 2), default the anchor centroid) is taken.
+        diss = np.asarray(diss, dtype=float)
+        mask = np.asarray(mask, dtype=bool)
+        out = np.full((len(diss), 2), np.nan)
+        full = mask.all(axis=1)
+        out[full] = self.compute_relative_batch(diss[full])
+        P = np.column_stack((self.X, self.Y))
+        prior = np.broadcast_to(P.mean(axis=0) if prior is None else np.asarray(prior, dtype=float), out.shape)
+        for i, j in ((0, 1), (0, 2), (1, 2)):
+            sel = mask[:, i] & mask[:, j] & (mask.sum(axis=1) == 2)
+            if not sel.any():
+                continue
+            base = P[j] - P[i]
+            d = np.hypot(*base)
+            r0, r1 = diss[sel, i], diss[sel, j]
+            a = (r0 * r0 - r1 * r1 + d * d) / (2 * d)
+            h = np.sqrt(np.maximum(r0 * r0 - a * a, 0.0))       # 0 when the circles do not meet
+            mid = P[i] + a[:, None] * base / d
+            perp = np.array([-base[1], base[0]]) / d
+            c1, c2 = mid + h[:, None] * perp, mid - h[:, None] * perp
+            near1 = ((c1 - prior[sel]) ** 2).sum(axis=1) <= ((c2 - prior[sel]) ** 2).sum(axis=1)
+            out[sel] = np.where(near1[:, None], c1, c2)
+        return out
+
     def compute_CRS(self):
         x, y = self.compute_relative()
-        print("multiplier:{}, {}".format(x_multiplier, y_multiplier))
-        return (x0 + (x / x_multiplier), y0 + (y / y_multiplier))
+        mx, my = multipliers
+        print("multiplier:{}, {}".format(mx, my))
+        return (x0 + (x / mx), y0 + (y / my))
+
+    def compute_CRS_batch(self, diss):
+        # diss: (N, 3) range triples in m -> (N, 2) relative and (N, 2) CRS coordinates
+        rel = self.compute_relative_batch(diss)
+        return rel, relative_to_CRS(rel)
+
+    def read_fix(self, n=5, deadline=FIX_DEADLINE):
+        # average of up to n complete range sets read within `deadline` s; without one, a degraded
+        # fix from the newest set with MIN_ANCHORS anchors; without that either, the last fix as stale
+        end = time.monotonic() + deadline
+        full, partial, mask = [], None, np.zeros(len(self.diss), dtype=bool)
+        while len(full) < n and self.ser_success:
+            left = end - time.monotonic()
+            if left <= 0:
+                break
+            diss, mask = self.UWB_read_deadline(min(DEADLINE, left))
+            if mask.all():
+                full.append(diss)
+                print(len(full))
+            elif mask.sum() >= MIN_ANCHORS:
+                partial = diss, mask
+        if full:
+            rel, status, mask = self.compute_relative_batch(np.array(full)).mean(axis=0), 'complete', np.ones_like(mask)
+        elif partial is not None:
+            diss, mask = partial
+            rel, status = self.compute_relative_partial_batch(diss[None], mask[None], self.last_rel)[0], 'degraded'
+            metrics.inc('degraded_fixes')
+        else:
+            if not self.stale:
+                metrics.inc('stale_fixes')
+                self.stale = True
+            if self.last_fix is None:
+                return PartialFix(None, tuple(mask.tolist()), 'stale', None)
+            return self.last_fix._replace(mask=tuple(mask.tolist()), status='stale')
+        self.last_rel = rel
+        self.stale = False
+        x, y = relative_to_CRS(rel)
+        self.last_fix = PartialFix((float(x), float(y)), tuple(mask.tolist()), status, time.time())
+        return self.last_fix
 
     def UWB_read_compute_CRS_5(self):
-        x, y = 0, 0
-        i = 0
-        while i < 5:
-            self.UWB_read()
-            if (0 not in self.diss):
-                _x, _y = self.compute_relative()
-                x += _x
-                y += _y
-                i += 1
-                print(i)
-        x /= 5
-        y /= 5
-        print("multiplier:{}, {}".format(x_multiplier, y_multiplier))
-        return (x0 + (x / x_multiplier), y0 + (y / y_multiplier))
+        # bounded by FIX_DEADLINE; None only before the first fix
+        fix = self.read_fix(5)
+        mx, my = multipliers
+        print("multiplier:{}, {}".format(mx, my))
+        if fix.status != 'complete':
+            print("{} fix, anchors reported: {}".format(fix.status, fix.mask))
+        return fix.pos
     # return (x0, y0 + (y / y_multiplier))
 
-    def recalibrate(self):
-        print("hold tag close to anchor 6")
-        d2, d3 = 0, 0
-        count = 1
-        while count <= 10:
-            diss = self.UWB_read()
-            if diss[0] < 0.1:
-                print(f"taking test value {count}/10...")
-                d2 += diss[1]
-                d3 += diss[2]
-                count += 1
-        d2 /= 10
-        d3 /= 10
-        x2, y2 = x02 - x0, y02 - y0
-        x3, y3 = x03 - x0, y03 - y0
-
-        delta = np.linalg.det([[x2*x2, y2*y2], [x3*x3, y3*y3]])
-        delta_x = np.linalg.det([[d2*d2, y2*y2], [d3*d3, y3*y3]])
-        delta_y = np.linalg.det([[x2*x2, d2*d2], [x3*x3, d3*d3]])
-        x_multiplier = (delta_x / delta)**(0.5)
-        y_multiplier = (delta_y / delta)**(0.5)
+    def compute_CRS_kalman(self, t=None):
+        # feed the current diss to the tracking filter; an incomplete read only predicts
+        if t is None:
+            t = time.monotonic()
+        z = self.compute_relative() if 0 not in self.diss else None
+        rel, cov = self.kf.step(z, t)
+        if rel is None:
+            return None, None
+        mx, my = multipliers
+        return (x0 + (rel[0] / mx), y0 + (rel[1] / my)), cov
+
+    def UWB_read_compute_CRS_kalman(self):
+        self.UWB_read()
+        return self.compute_CRS_kalman()
+
+    def recalibrate(self, timeout=RECALIBRATE_TIMEOUT, anchor=None):
+        # blocking variant of calibration.Calibration, for use without the server; None on timeout
+        # anchor: number of the anchor the tag is held at (None = whichever reads closest)
+        from calibration import Calibration
+        print("hold tag close to anchor {}".format("6, 7 or 9" if anchor is None else anchor))
+        calib = Calibration()
+        calib.start(anchor=anchor)
+        self.flush()
+        end = time.monotonic() + timeout
+        while calib.samples < calib.min_samples:
+            if time.monotonic() >= end or not self.ser_success:
+                calib.cancel()
+                print(f"recalibration timed out after {calib.samples}/{calib.min_samples} samples")
+                return None
+            # the raw set: the range to the anchor the tag sits on reads 0
+            diss, _ = self.UWB_read_deadline(min(DEADLINE, max(end - time.monotonic(), 0)))
+            if calib.add(diss):
+                print(f"taking test value {calib.samples}/{calib.min_samples}...")
+        result = calib.commit()
+        if result is None:
+            print("recalibration failed: the samples do not determine both multipliers")
+            return None
+        x, y = result
         print("recalibration completed! new multipliers:")
-        print(f"x = {x_multiplier}")
-        print(f"y = {y_multiplier}")
-        return x_multiplier, y_multiplier
+        print(f"x = {x}")
+        print(f"y = {y}")
+        return x, y
 
     def get_anchor_CRS(self, idx):
         if idx == '6':
@@ -160,10 +293,12 @@ if __name__ == '__main__':
     try:
         uwbpos = UWBpos()
         for i in range(10):
-            dis_to_tag = uwbpos.UWB_read()
+            dis_to_tag, mask = uwbpos.UWB_read_deadline()
             print("anchor ID 6: " + str(dis_to_tag[0]), end="\t")
             print("anchor ID 7: " + str(dis_to_tag[1]), end="\t")
             print("anchor ID 9: " + str(dis_to_tag[2]))
+            if not mask.all():
+                continue
             x, y = uwbpos.compute_CRS()  
             print("(x, y) = ({}, {})".format(x, y))
 
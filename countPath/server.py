@@ -1,12 +1,45 @@
-from flask import Flask, request, jsonify
-from threading import Thread
+import json
+import time
+from flask import Flask, Response, request, jsonify, g
 from flask_cors import CORS
-from findRoute import findRoute
+from findRoute import findRoute, route_cache
 from read_GIPS_distance import UWBpos
+from uwb_hub import DEFAULT_TAG, SensorHub, mark_stale, stream_fixes, tag_fix
+from uwb_metrics import metrics
 app = Flask(__name__)
 CORS(app)
 pos = UWBpos()
 # pos.recalibrate()
+# UWB_REPLAY=<capture file> replays a recorded session instead of the port, see uwb_capture.py
+hub = SensorHub(pos)    # SensorHub(pos, fake=True) if you don't have UWB module
+                        # SensorHub(pos, kalman=True) to track every read instead of averaging 5
+                        # SensorHub(pos, cir=monitor) to down-weight NLOS anchors, see cir_analysis.py
+hub.start()
+STREAM_RATE = 10        # max fixes per second pushed to one /pos/stream client
+
+
+@app.before_request
+def startTimer():
+    g.start = time.perf_counter()
+
+
+@app.after_request
+def stopTimer(response):
+    # handler time only; a /pos/stream body is sent after this
+    if 'start' in g:
+        rule = request.url_rule.rule if request.url_rule else 'unmatched'
+        metrics.observe('http', time.perf_counter() - g.start, route=rule)
+    return response
+
+
+@app.route('/metrics')
+def getMetrics():
+    stats = route_cache.stats()
+    extra = [('uwb_route_cache_hits_total', 'counter', stats['hits'], 'Routes served from the cache.'),
+             ('uwb_route_cache_misses_total', 'counter', stats['misses'], 'Routes planned from scratch.'),
+             ('uwb_route_cache_size', 'gauge', stats['size'], 'Routes held in the cache.'),
+             ('uwb_fixes_total', 'counter', hub.latest.seq, 'Fixes published since start.')]
+    return Response(metrics.render(extra), mimetype='text/plain; version=0.0.4')
 
 
 @app.route('/dest', methods=['POST'])
@@ -21,62 +54,54 @@ def dest():
     return jsonify(response_data), 200
 
 
+@app.route('/dest/cache')
+def destCache():
+    return jsonify(route_cache.stats()), 200
+
+
 @app.route('/pos')
 def getPos():
-    print("call getPos")
-    # pos.recalibrate()
-    # pos.fake_read()     # if you don't have UWB module, use this
-    pos.UWB_read()      # if you have UWB module, use this
-    # x, y = pos.compute_CRS()
-    x, y = pos.UWB_read_compute_CRS_5()
-    # x, y = pos.get_anchor_CRS('9')
-    print(f"coordinate: {y}, {x}")
-    return jsonify([x, y]), 200
+    # one tag (?tag=ID, default DEFAULT_TAG); every tag is in /pos/all
+    fix = mark_stale(tag_fix(hub.fixes, request.args.get('tag', DEFAULT_TAG)))
+    if fix.pos is None:
+        return jsonify(fix._asdict()), 503
+    return jsonify(fix._asdict()), 200
 
 
-@app.route('/pos/anchor/<anchor_number>')
-def getAnchorPos(anchor_number):
-    x, y = pos.get_anchor_CRS(anchor_number)
-    return jsonify([x, y]), 200
+@app.route('/pos/stream')
+def posStream():
+    # Server-Sent Events: push every new fix of one tag (?tag=ID, default DEFAULT_TAG, * = every tag),
+    # at most `rate` per second (?rate=N, 0 = no cap)
+    rate = request.args.get('rate', STREAM_RATE, type=float)
+    tag = request.args.get('tag', DEFAULT_TAG)
+    interval = 1 / rate if rate > 0 else 0
 
+    def stream():
+        seq = 0
+        while True:
+            if hub.wait(seq, timeout=15).seq == seq:
+                yield ': keep-alive\n\n'
+                continue
+            fixes = hub.fixes
+            for fix in stream_fixes(fixes, seq, tag):
+                yield 'data: {}\n\n'.format(json.dumps(fix._asdict()))
+            seq = max(f.seq for f in fixes.values())
+            time.sleep(interval)
 
-@app.route('/pos/recalibrate')
-def recalibrate():
-    x, y = pos.recalibrate()
-    return jsonify([x, y]), 200
+    return Response(stream(), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache'})
 
 
-if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=5500, debug=True)
+@app.route('/pos/all')
+def getAllPos():
+    return jsonify({tag: mark_stale(fix)._asdict() for tag, fix in hub.fixes.items()}), 200
 
-app = Flask(__name__)
-CORS(app)
-pos = UWBpos()
-# pos.recalibrate()
 
-
-@app.route('/dest', methods=['POST'])
-def dest():
-    print('Destination received')
-    print(request.json['dest'])
-
-    route = findRoute(request.json['st'], request.json['dest'])
-    response_data = {
-        'route': route
-    }
-    return jsonify(response_data), 200
-
-
-@app.route('/pos')
-def getPos():
-    # pos.recalibrate()
-    # pos.fake_read()     # if you don't have UWB module, use this
-    pos.UWB_read()      # if you have UWB module, use this
-    # x, y = pos.compute_CRS()
-    x, y = pos.UWB_read_compute_CRS_5()
-    # x, y = pos.get_anchor_CRS('6')
-    print(f"coordinate: {y}, {x}")
-    return jsonify([x, y]), 200
+@app.route('/pos/<tag_id>')
+def getTagPos(tag_id):
+    fix = hub.fixes.get(tag_id)
+    if fix is None:
+        return jsonify({'tag': tag_id, 'pos': None}), 404
+    return jsonify(mark_stale(fix)._asdict()), 200
 
 
 @app.route('/pos/anchor/<anchor_number>')
@@ -85,11 +110,35 @@ def getAnchorPos(anchor_number):
     return jsonify([x, y]), 200
 
 
+@app.route('/pos/recalibrate/start', methods=['POST'])
+def recalibrateStart():
+    # hold the tag at an anchor ({"anchor": "6"} names it); the hub feeds every range set to the running estimate
+    body = request.get_json(silent=True) or {}
+    try:
+        hub.calibration.start(body.get('tag'), body.get('anchor'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(hub.calibration.status()), 202
+
+
 @app.route('/pos/recalibrate')
-def recalibrate():
-    x, y = pos.recalibrate()
-    return jsonify([x, y]), 200
+@app.route('/pos/recalibrate/status')
+def recalibrateStatus():
+    return jsonify(hub.calibration.status()), 200
+
+
+@app.route('/pos/recalibrate/commit', methods=['POST'])
+def recalibrateCommit():
+    if hub.calibration.commit() is None:
+        return jsonify(hub.calibration.status()), 409
+    return jsonify(hub.calibration.status()), 200
+
+
+@app.route('/pos/recalibrate/cancel', methods=['POST'])
+def recalibrateCancel():
+    hub.calibration.cancel()
+    return jsonify(hub.calibration.status()), 200
 
 
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=5500, debug=True)
+    app.run(host="0.0.0.0", port=5500, debug=True, use_reloader=False)
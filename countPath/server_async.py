@@ -0,0 +1,215 @@
+"""
+asyncio variant of server.py: one event loop owns the UWB port, solves every
+fix as frames arrive and serves /pos, /pos/all, /pos/<tag_id>, /pos/stream,
+/pos/anchor/<n>, /pos/recalibrate/*, /dest and /metrics to any number of
+clients, without a thread per request. Run with `python3 server_async.py` (add `--fake` without UWB module).
+"""
+import asyncio
+import json
+import sys
+import time
+import traceback
+from collections import namedtuple
+from urllib.parse import urlsplit, parse_qs
+
+from calibration import Calibration
+from findRoute import findRoute, route_cache
+from read_GIPS_distance import UWBpos, anchor_IDs
+from uwb_async import AsyncFrameReader
+from uwb_frame import RangeFrame
+from uwb_hub import DEFAULT_TAG, Fix, TagTable, new_fix, mark_stale, stream_fixes, tag_fix
+from uwb_metrics import metrics
+
+HOST, PORT = '0.0.0.0', 5500
+STREAM_RATE = 10        # max fixes per second pushed to one /pos/stream client
+FAKE_INTERVAL = 0.1     # seconds between fake reads
+DEADLINE_TICK = 0.1     # seconds between range-set deadline checks
+
+Request = namedtuple('Request', ['method', 'path', 'query', 'body'])
+
+
+class AsyncHub:
+    # same role as uwb_hub.SensorHub, but driven by the event loop instead of a thread
+    def __init__(self, uwbpos, kalman=False, cir=None):
+        self.pos = uwbpos
+        self.cir = cir
+        self.tags = TagTable(uwbpos, kalman=kalman)
+        self.calibration = Calibration()
+        self.latest = Fix(0, None, None, (), None, None)
+        self.fixes = {}
+        self.published = asyncio.Condition()
+        self.tasks = set()  # the loop only keeps weak references to its tasks
+
+    def on_frames(self, frames):
+        if self.cir is not None:
+            frames = self.cir.annotate(frames)
+        self.tags.add(frames)
+        solved = self.tags.solve()
+        for result in solved:
+            tag, diss, status = result[0], result[2], result[8]
+            if status in ('complete', 'degraded'):
+                self.calibration.add(diss, tag)
+            self.latest = new_fix(self.latest.seq + 1, *result)
+            self.fixes = dict(self.fixes)
+            self.fixes[tag] = self.latest
+        if solved:
+            self.spawn(self._notify())
+
+    def spawn(self, coro):
+        task = asyncio.get_running_loop().create_task(coro)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return task
+
+    async def _notify(self):
+        async with self.published:
+            self.published.notify_all()
+
+    async def wait(self, seq, timeout):
+        async with self.published:
+            try:
+                await asyncio.wait_for(self.published.wait_for(lambda: self.latest.seq > seq), timeout)
+            except asyncio.TimeoutError:
+                pass
+            return self.latest
+
+    async def deadlines(self, interval=DEADLINE_TICK):
+        # frames only arrive when anchors report: check the range-set deadlines on a timer too
+        while True:
+            await asyncio.sleep(interval)
+            self.on_frames([])
+
+    async def fake_reads(self, interval=FAKE_INTERVAL):
+        while True:
+            self.pos.fake_read()
+            self.on_frames([RangeFrame(i, anchor_IDs[i], int(d * 100)) for i, d in enumerate(self.pos.diss)])
+            await asyncio.sleep(interval)
+
+
+def response(writer, status, body, content_type='application/json'):
+    if not isinstance(body, bytes):
+        body = json.dumps(body).encode()
+    writer.write('HTTP/1.1 {}\r\nContent-Type: {}\r\nContent-Length: {}\r\n'
+                 'Access-Control-Allow-Origin: *\r\nConnection: close\r\n\r\n'
+                 .format(status, content_type, len(body)).encode() + body)
+
+
+async def read_request(reader):
+    head = await reader.readuntil(b'\r\n\r\n')
+    lines = head.decode('latin-1').split('\r\n')
+    method, target, _ = lines[0].split(' ', 2)
+    headers = {}
+    for line in lines[1:]:
+        if ':' in line:
+            key, value = line.split(':', 1)
+            headers[key.strip().lower()] = value.strip()
+    length = int(headers.get('content-length', 0))
+    body = await reader.readexactly(length) if length else b''
+    url = urlsplit(target)
+    return Request(method, url.path.rstrip('/') or '/', parse_qs(url.query), body)
+
+
+async def stream(writer, hub, rate, tag=DEFAULT_TAG):
+    # Server-Sent Events, see server.posStream
+    writer.write(b'HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nCache-Control: no-cache\r\n'
+                 b'Access-Control-Allow-Origin: *\r\n\r\n')
+    interval = 1 / rate if rate > 0 else 0
+    seq = 0
+    while True:
+        if (await hub.wait(seq, timeout=15)).seq == seq:
+            writer.write(b': keep-alive\n\n')
+        for fix in stream_fixes(hub.fixes, seq, tag):
+            writer.write('data: {}\n\n'.format(json.dumps(fix._asdict())).encode())
+        seq = hub.latest.seq
+        await writer.drain()
+        await asyncio.sleep(interval)
+
+
+def make_handler(hub):
+    async def handle(reader, writer):
+        try:
+            req = await read_request(reader)
+            start = time.perf_counter()
+            parts = req.path.strip('/').split('/')
+            rule = req.path
+            if req.method == 'OPTIONS':
+                writer.write(b'HTTP/1.1 204 No Content\r\nAccess-Control-Allow-Origin: *\r\n'
+                             b'Access-Control-Allow-Methods: GET, POST, OPTIONS\r\n'
+                             b'Access-Control-Allow-Headers: Content-Type\r\nConnection: close\r\n\r\n')
+            elif req.method == 'POST' and req.path == '/dest':
+                data = json.loads(req.body)
+                route = await asyncio.get_running_loop().run_in_executor(None, findRoute, data['st'], data['dest'])
+                response(writer, '200 OK', {'route': route})
+            elif req.path == '/pos':
+                fix = mark_stale(tag_fix(hub.fixes, req.query.get('tag', [DEFAULT_TAG])[0]))
+                response(writer, '503 Service Unavailable' if fix.pos is None else '200 OK', fix._asdict())
+            elif req.path == '/pos/all':
+                response(writer, '200 OK', {tag: mark_stale(fix)._asdict() for tag, fix in hub.fixes.items()})
+            elif req.path == '/pos/stream':
+                metrics.observe('http', time.perf_counter() - start, route=rule)
+                await stream(writer, hub, float(req.query.get('rate', [STREAM_RATE])[0]),
+                             req.query.get('tag', [DEFAULT_TAG])[0])
+                return
+            elif req.path == '/metrics':
+                stats = route_cache.stats()
+                extra = [('uwb_route_cache_hits_total', 'counter', stats['hits'], 'Routes served from the cache.'),
+                         ('uwb_route_cache_misses_total', 'counter', stats['misses'], 'Routes planned from scratch.'),
+                         ('uwb_route_cache_size', 'gauge', stats['size'], 'Routes held in the cache.'),
+                         ('uwb_fixes_total', 'counter', hub.latest.seq, 'Fixes published since start.')]
+                response(writer, '200 OK', metrics.render(extra).encode(), 'text/plain; version=0.0.4')
+            elif req.path in ('/pos/recalibrate', '/pos/recalibrate/status'):
+                response(writer, '200 OK', hub.calibration.status())
+            elif req.method == 'POST' and req.path == '/pos/recalibrate/start':
+                body = json.loads(req.body) if req.body else {}
+                hub.calibration.start(body.get('tag'), body.get('anchor'))
+                response(writer, '202 Accepted', hub.calibration.status())
+            elif req.method == 'POST' and req.path == '/pos/recalibrate/commit':
+                ok = hub.calibration.commit() is not None
+                response(writer, '200 OK' if ok else '409 Conflict', hub.calibration.status())
+            elif req.method == 'POST' and req.path == '/pos/recalibrate/cancel':
+                hub.calibration.cancel()
+                response(writer, '200 OK', hub.calibration.status())
+            elif len(parts) == 3 and parts[:2] == ['pos', 'anchor']:
+                rule = '/pos/anchor/<anchor_number>'
+                response(writer, '200 OK', list(hub.pos.get_anchor_CRS(parts[2])))
+            elif len(parts) == 2 and parts[0] == 'pos':
+                rule = '/pos/<tag_id>'
+                fix = hub.fixes.get(parts[1])
+                if fix is None:
+                    response(writer, '404 Not Found', {'tag': parts[1], 'pos': None})
+                else:
+                    response(writer, '200 OK', mark_stale(fix)._asdict())
+            else:
+                rule = 'unmatched'
+                response(writer, '404 Not Found', {'error': 'not found'})
+            metrics.observe('http', time.perf_counter() - start, route=rule)
+            await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        except (ValueError, KeyError, asyncio.LimitOverrunError) as e:
+            # bad client input (a JSONDecodeError is a ValueError): 400, like the Flask server
+            response(writer, '400 Bad Request', {'error': '{}: {}'.format(type(e).__name__, e)})
+        except Exception:
+            traceback.print_exc()
+            response(writer, '500 Internal Server Error', {'error': 'internal server error'})
+        finally:
+            writer.close()
+    return handle
+
+
+async def main(fake=False, kalman=False):
+    pos = UWBpos()
+    hub = AsyncHub(pos, kalman=kalman)
+    hub.spawn(hub.deadlines())
+    if fake:
+        hub.spawn(hub.fake_reads())
+    elif pos.ser_success:
+        AsyncFrameReader(pos.ser_UWB, pos.parser, hub.on_frames).start()
+    server = await asyncio.start_server(make_handler(hub), HOST, PORT)
+    print("serving on {}:{}".format(HOST, PORT))
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(fake='--fake' in sys.argv, kalman='--kalman' in sys.argv))
@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+"""
+Vectorized Monte Carlo study of the positioning error over a grid of tag positions.
+
+For every grid cell, `trials` noisy range sets (Gaussian noise, NLOS bias,
+dropouts) are generated as one (cells, trials, anchors) array and solved with
+the batch solvers of distance_3d. The result is the error distribution of
+each cell: horizontal / 3D RMSE, CEP95, bias and fix availability, next to
+the GDOP of the layout. Cells are split in chunks that can fan out over a
+process pool; every cell has its own seed, so the result does not depend on
+the number of workers.
+
+    python3 simulate.py --layout 3dinfo --step 0.25 --trials 2000 --workers 4 -o sim.npz
+    python3 simulate.py --layout 2d --noise 0.1 --nlos 0.1 --dropout 0.05 --plot
+"""
+import argparse
+import os
+import time
+import warnings
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from distance_3d import LinearSolver3D, LMSolver3D, RANSACSolver3D
+from gdop import gdop_batch
+from uwb_emulator import LAYOUTS
+
+SOLVERS = ['linear', 'lm', 'ransac']
+CHUNK_VALUES = 2 ** 22      # range values per chunk (~32 MB of float64)
+
+# range error model and solver of one study
+SimConfig = namedtuple('SimConfig', ['trials', 'noise', 'nlos', 'nlos_bias', 'dropout', 'solver'],
+                       defaults=(1000, 0.05, 0.0, 1.0, 0.0, 'linear'))
+
+# per-cell statistics, in metres unless noted
+STATS = ['rmse_2d', 'rmse_3d', 'cep95', 'bias_x', 'bias_y', 'bias_z', 'availability', 'gdop']
+
+
+def grid_points(anchors, step, z=None, margin=0.0):
+    # (x, y) grid over the anchor bounding box; 3D layouts at height z (default: mean anchor height)
+    anchors = np.asarray(anchors, dtype=float)
+    lo, hi = anchors[:, :2].min(axis=0) - margin, anchors[:, :2].max(axis=0) + margin
+    xs = lo[0] + step * np.arange(int(np.floor((hi[0] - lo[0]) / step + 1e-9)) + 1)
+    ys = lo[1] + step * np.arange(int(np.floor((hi[1] - lo[1]) / step + 1e-9)) + 1)
+    xy = np.stack(np.meshgrid(xs, ys, indexing='ij'), axis=-1).reshape(-1, 2)
+    if anchors.shape[1] == 2:
+        return xs, ys, xy
+    height = anchors[:, 2].mean() if z is None else z
+    return xs, ys, np.column_stack((xy, np.full(len(xy), height)))
+
+
+def simulate_ranges(anchors, points, config, rng):
+    # (cells, trials, anchors) noisy ranges; a dropped range is 0, like an invalid frame
+    true = np.linalg.norm(points[:, None] - anchors[None], axis=2)           # (cells, anchors)
+    shape = (len(points), config.trials, len(anchors))
+    if not isinstance(rng, np.random.Generator):
+        # one seed per cell: draw each cell's block with its own generator
+        out = np.empty(shape)
+        for i, seed in enumerate(rng):
+            out[i] = simulate_ranges(anchors, points[i:i + 1], config, np.random.default_rng(seed))[0]
+        return out
+    dists = true[:, None] + rng.normal(0.0, config.noise, shape)
+    if config.nlos > 0:
+        # NLOS ranges are only ever longer: exponential extra path with mean nlos_bias
+        dists += (rng.random(shape) < config.nlos) * rng.exponential(config.nlos_bias, shape)
+    dists = np.maximum(dists, 0.01)
+    if config.dropout > 0:
+        dists[rng.random(shape) < config.dropout] = 0.0
+    return dists
+
+
+class BatchSolver:
+    """
+    Solves (N, anchors) range sets with some ranges missing (0): rows are
+    grouped by their set of valid anchors and each group is solved in one
+    batch. Rows with fewer than dimension + 1 valid ranges get nan.
+    """
+
+    def __init__(self, anchors, solver='linear'):
+        self.anchors = np.asarray(anchors, dtype=float)
+        self.solver = solver
+        d = self.anchors.shape[1]
+        self.lm = LMSolver3D(self.anchors, lower=-np.inf) if solver == 'lm' else None
+        self.ransac = RANSACSolver3D(self.anchors) if solver == 'ransac' and len(self.anchors) > d + 1 else None
+        self.linear = {}        # valid-anchor mask -> LinearSolver3D
+
+    def solve(self, dists):
+        n, d = len(dists), self.anchors.shape[1]
+        valid = dists > 0
+        out = np.full((n, d), np.nan)
+        for mask in np.unique(valid, axis=0):
+            if mask.sum() < d + 1:
+                continue
+            sel = (valid == mask).all(axis=1)
+            sub = dists[sel][:, mask]
+            if self.ransac is not None and mask.all():
+                out[sel] = self.ransac.solve(sub)[0]
+                continue
+            key = tuple(mask.tolist())
+            linear = self.linear.get(key)
+            if linear is None:
+                linear = self.linear[key] = LinearSolver3D(self.anchors[mask])
+            out[sel] = linear.solve(sub)
+        if self.lm is not None:
+            ok = ~np.isnan(out[:, 0])
+            out[ok] = self.lm.solve(dists[ok], out[ok], weights=valid[ok])
+        return out
+
+
+def cell_stats(points, est, anchors):
+    # points (cells, d), est (cells, trials, d) -> (cells, len(STATS))
+    err = est - points[:, None]
+    ok = ~np.isnan(err[..., 0])
+    h2 = (err[..., :2] ** 2).sum(axis=2)
+    s2 = (err ** 2).sum(axis=2)
+    stats = np.full((len(points), len(STATS)), np.nan)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)     # all-nan cells (no fix at all) stay nan
+        stats[:, 0] = np.sqrt(np.nanmean(h2, axis=1))
+        stats[:, 1] = np.sqrt(np.nanmean(s2, axis=1))
+        stats[:, 2] = np.nanpercentile(np.sqrt(h2), 95, axis=1)
+        bias = np.nanmean(err, axis=1)
+    stats[:, 3:3 + bias.shape[1]] = bias
+    stats[:, 6] = ok.mean(axis=1)
+    stats[:, 7] = gdop_batch(anchors, points)
+    return stats
+
+
+def run_chunk(anchors, points, config, seeds):
+    # one unit of work, also the process pool entry point
+    dists = simulate_ranges(anchors, points, config, seeds)
+    est = BatchSolver(anchors, config.solver).solve(dists.reshape(-1, len(anchors)))
+    return cell_stats(points, est.reshape(len(points), config.trials, -1), anchors)
+
+
+def simulate(anchors, points, config=SimConfig(), workers=1, seed=0):
+    """(cells, len(STATS)) error statistics of every grid point; workers > 1 uses a process pool"""
+    anchors = np.asarray(anchors, dtype=float)
+    points = np.asarray(points, dtype=float)
+    per_chunk = max(1, CHUNK_VALUES // (config.trials * len(anchors)))
+    if workers > 1:
+        # at least a few chunks per worker so the pool stays busy
+        per_chunk = max(1, min(per_chunk, -(-len(points) // (4 * workers))))
+    seeds = np.random.SeedSequence(seed).spawn(len(points))
+    chunks = [(anchors, points[s:s + per_chunk], config, seeds[s:s + per_chunk])
+              for s in range(0, len(points), per_chunk)]
+    if workers > 1 and len(chunks) > 1:
+        with ProcessPoolExecutor(workers) as pool:
+            results = list(pool.map(run_chunk, *zip(*chunks)))
+    else:
+        results = [run_chunk(*c) for c in chunks]
+    return np.concatenate(results)
+
+
+def plot_stats(xs, ys, stats, anchors, path, key='cep95'):
+    import matplotlib.pyplot as plt
+    grid = stats[:, STATS.index(key)].reshape(len(xs), len(ys))
+    plt.figure(figsize=(7, 6))
+    plt.pcolormesh(xs, ys, grid.T * 100, shading='nearest', cmap='viridis')
+    plt.colorbar(label='{} (cm)'.format(key))
+    plt.scatter(anchors[:, 0], anchors[:, 1], c='red', marker='^', label='anchors')
+    plt.gca().set_aspect('equal')
+    plt.xlabel('x (m)')
+    plt.ylabel('y (m)')
+    plt.legend()
+    plt.title('Monte Carlo {}'.format(key))
+    plt.savefig(path, dpi=150)
+    plt.close()
+    print('plot saved to {}'.format(path))
+
+
+def main():
+    ap = argparse.ArgumentParser(description='Monte Carlo positioning error over a grid of tag positions')
+    ap.add_argument('--layout', choices=sorted(LAYOUTS), default='3dinfo')
+    ap.add_argument('--step', type=float, default=0.25, help='grid spacing (m)')
+    ap.add_argument('--margin', type=float, default=0.0, help='grid extends this far beyond the anchors (m)')
+    ap.add_argument('--z', type=float, default=None, help='tag height for 3D layouts (m)')
+    ap.add_argument('--trials', type=int, default=1000, help='range sets per grid cell')
+    ap.add_argument('--noise', type=float, default=0.05, help='range noise std (m)')
+    ap.add_argument('--nlos', type=float, default=0.0, help='probability a range is NLOS')
+    ap.add_argument('--nlos-bias', type=float, default=1.0, help='mean extra NLOS distance (m)')
+    ap.add_argument('--dropout', type=float, default=0.0, help='probability a range is lost')
+    ap.add_argument('--solver', choices=SOLVERS, default='linear')
+    ap.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    ap.add_argument('--seed', type=int, default=0)
+    ap.add_argument('-o', '--out', help='save xs, ys, points and per-cell stats to this .npz')
+    ap.add_argument('--plot', nargs='?', const='simulate.png', default=None, help='CEP95 heat map (PNG path)')
+    args = ap.parse_args()
+
+    anchors = np.array(LAYOUTS[args.layout][1])
+    if args.layout == '2d':
+        anchors = anchors[:, :2]
+    xs, ys, points = grid_points(anchors, args.step, args.z, args.margin)
+    config = SimConfig(args.trials, args.noise, args.nlos, args.nlos_bias, args.dropout, args.solver)
+
+    start = time.perf_counter()
+    stats = simulate(anchors, points, config, args.workers, args.seed)
+    elapsed = time.perf_counter() - start
+    total = len(points) * args.trials
+    print('{} cells x {} trials = {} range sets in {:.2f} s ({:.0f} fixes/s, {} workers)'.format(
+        len(points), args.trials, total, elapsed, total / elapsed, args.workers))
+    for key in STATS:
+        col = stats[:, STATS.index(key)]
+        if np.isnan(col).all():
+            continue
+        print('{:>12}: median {:.4f}  p95 {:.4f}  max {:.4f}'.format(
+            key, np.nanmedian(col), np.nanpercentile(col, 95), np.nanmax(col)))
+    worst = np.nanargmax(stats[:, STATS.index('cep95')])
+    print('worst cell {} CEP95 {:.3f} m'.format(np.round(points[worst], 3).tolist(), stats[worst, STATS.index('cep95')]))
+
+    if args.out:
+        np.savez(args.out, xs=xs, ys=ys, points=points, anchors=anchors, stats=stats, columns=STATS,
+                 **config._asdict())
+        print('saved to {}'.format(args.out))
+    if args.plot:
+        plot_stats(xs, ys, stats, anchors, args.plot)
+
+
+if __name__ == '__main__':
+    main()
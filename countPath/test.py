@@ -1,4 +1,7 @@
-import serial, binascii, time, numpy as np
+import time, numpy as np
+from uwb_frame import FrameParser
+from uwb_capture import open_serial
+from distance_3d import LinearSolver3D
 
 # Anchor Cartesian 座標
 anchors = {
@@ -13,7 +16,9 @@ BAUD_RATE = 57600
 
 class UWB3D:
     def __init__(self):
-        self.ser = serial.Serial(COM_PORT, BAUD_RATE, timeout=0.1)
+        self.ser = open_serial(COM_PORT, BAUD_RATE, timeout=0.1)
+        self.parser = FrameParser(anchor_IDs)
+        self.solver = LinearSolver3D([anchors[aid] for aid in anchor_IDs])
         time.sleep(1)  # 等模組啟動
 
     def read_distances(self, timeout=1.0):
@@ -23,38 +28,19 @@ class UWB3D:
         回傳 dict{aid: dist(m) or None}
         """
         end = time.time() + timeout
-        buf = ""  # 累積 hex string
         distances = {aid: None for aid in anchor_IDs}
         while time.time() < end and any(v is None for v in distances.values()):
             n = self.ser.in_waiting or 1
             data = self.ser.read(n)
             if not data:
                 continue
-            buf += binascii.hexlify(data).decode()
-            # 嘗試解析每一顆
-            for aid in anchor_IDs:
-                if distances[aid] is None and aid in buf:
-                    idx   = buf.find(aid)
-                    start = idx + 18     # ← 根據實際偏移再微調
-                    hex_d = buf[start:start+8][::-1]
-                    raw_d = int(hex_d, 16)
-                    distances[aid] = (raw_d if raw_d < 32768 else 0) / 100.0
+            for frame in self.parser.feed(data):
+                distances[frame.anchor_ID] = frame.dis
         return distances
 
     def trilaterate(self, dists):
         # 最小平方 3D Trilateration
-        ids = anchor_IDs
-        P1, r1 = anchors[ids[0]], dists[ids[0]]
-        A, b = [], []
-        x1,y1,z1 = P1
-        for aid in ids[1:]:
-            Pi, ri = anchors[aid], dists[aid]
-            xi, yi, zi = Pi
-            A.append([2*(xi-x1), 2*(yi-y1), 2*(zi-z1)])
-            b.append((xi*xi+yi*yi+zi*zi - ri*ri)
-                   - (x1*x1+y1*y1+z1*z1 - r1*r1))
-        sol, *_ = np.linalg.lstsq(np.array(A), np.array(b), rcond=None)
-        return sol  # [x,y,z]
+        return self.solver.solve([dists[aid] for aid in anchor_IDs])  # [x,y,z]
 
     def run(self):
         try:
@@ -0,0 +1,17 @@
+import contextlib
+import io
+import os
+import sys
+
+import pytest
+
+# the modules of countPath are flat scripts, imported by name
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(scope='module')
+def uwbpos():
+    # UWBpos without a port (the default one is not there on a test machine)
+    from read_GIPS_distance import UWBpos
+    with contextlib.redirect_stdout(io.StringIO()):
+        return UWBpos()
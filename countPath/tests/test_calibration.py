@@ -0,0 +1,48 @@
+import numpy as np
+import pytest
+
+import read_GIPS_distance as gips
+from calibration import Calibration
+from uwb_frame import RangeFrame
+from uwb_hub import TagTable
+
+
+def baselines(at):
+    # true ranges (m) from anchor `at` to every anchor, 0 to itself
+    anchors = np.array([(gips.x0, gips.y0), (gips.x02, gips.y02), (gips.x03, gips.y03)])
+    return np.hypot(*((anchors - anchors[at]) * gips.multipliers).T)
+
+
+def frames(diss, t, seq):
+    return [RangeFrame(i, gips.anchor_IDs[i], int(round(d * 100)), '', None, t, seq) for i, d in enumerate(diss)]
+
+
+def test_hub_sets_with_a_zero_range_reach_the_calibration(uwbpos):
+    # the tag sits on anchor 7: its range reads 0, so the set is solved as degraded
+    calib = Calibration()
+    calib.start(anchor='7')
+    table = TagTable(uwbpos)
+    for k in range(calib.min_samples):
+        table.add(frames(baselines(1), 100.0 + k, k + 1))
+        for tag, crs, diss, *_, status, measured in table.solve(100.0 + k):
+            assert status == 'degraded'
+            assert calib.add(diss, tag)
+    x, y, rms = calib.estimate()
+    assert np.allclose((x, y), gips.multipliers, rtol=1e-2)     # ranges are whole cm
+
+
+def test_named_anchor_rejects_other_invalid_ranges():
+    calib = Calibration()
+    calib.start(anchor='6')
+    diss = baselines(0)
+    assert calib.add(diss)
+    lost = diss.copy()
+    lost[2] = 0                 # a lost range elsewhere is not "tag at anchor 9"
+    assert not calib.add(lost)
+    assert calib.samples == 1
+    assert calib.status()['anchor'] == '6'
+
+
+def test_unknown_anchor():
+    with pytest.raises(ValueError):
+        Calibration().start(anchor='8')
@@ -0,0 +1,36 @@
+import numpy as np
+
+from cir import CIRParser
+
+
+def block(anchor_line, values):
+    return (anchor_line + '\n' + '\n'.join(str(v) for v in values) + '\n').encode()
+
+
+def test_colon_space_header():
+    # "ANCHOR_ID: <id>" used to split into its own digit token and overflow int32
+    parser = CIRParser(n=4)
+    out = parser.feed(block('ANCHOR_ID: 0241000000000000', [1, 2, 3, 4]))
+    assert len(out) == 1
+    anchor_id, t, cir = out[0]
+    assert anchor_id == '0241000000000000'
+    assert cir.tolist() == [1, 2, 3, 4]
+
+
+def test_lines_split_across_reads():
+    parser = CIRParser(n=4)
+    data = block('ANCHOR_ID:0341000000000000', [10, 20, 30, 40]) + block('ANCHOR_ID:0541000000000000', [5, 6, 7, 8])
+    out = []
+    for i in range(0, len(data), 7):
+        out += parser.feed(data[i:i + 7])
+    assert [(a, c.tolist()) for a, _, c in out] == [('0341000000000000', [10, 20, 30, 40]),
+                                                    ('0541000000000000', [5, 6, 7, 8])]
+
+
+def test_oversized_and_garbage_lines_are_dropped():
+    # a lost newline joins two samples into one number that does not fit int32
+    parser = CIRParser(n=3)
+    data = b'ANCHOR_ID:0241000000000000\r\n1\r\n12345678901234\r\n2 3\r\nx\r\n\r\n4\r\n5\r\n'
+    (anchor_id, _, cir), = parser.feed(data)
+    assert cir.dtype == np.int32
+    assert cir.tolist() == [1, 4, 5]
@@ -0,0 +1,25 @@
+import numpy as np
+
+from distance_3d import LMSolver3D
+
+ANCHORS = np.array([(4.0, 0.0, 2.0), (4.0, 2.0, 0.0), (5.0, 8.0, 2.0), (0.0, 6.0, 1.5), (1.0, 1.0, 2.5)])
+
+
+def synth(n, noise, seed=0):
+    rng = np.random.default_rng(seed)
+    tags = rng.random((n, 3)) * [5.0, 8.0, 2.5]
+    return tags, np.linalg.norm(tags[:, None] - ANCHORS[None], axis=2) + rng.normal(0, noise, (n, len(ANCHORS)))
+
+
+def test_exact_ranges():
+    tags, dists = synth(200, 0.0)
+    assert np.allclose(LMSolver3D(ANCHORS).solve(dists), tags, atol=1e-6)
+
+
+def test_converges_within_the_default_cap():
+    # the default cap must not cut any set short: a much longer run does not move the result
+    _, dists = synth(2000, 0.1)
+    x = LMSolver3D(ANCHORS).solve(dists)
+    ref = LMSolver3D(ANCHORS, iterations=1000).solve(dists)
+    assert np.abs(x - ref).max() < 1e-4
+
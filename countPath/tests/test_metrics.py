@@ -0,0 +1,60 @@
+import read_GIPS_distance as gips
+from uwb_emulator import build_frame
+from uwb_metrics import Metrics, metrics
+
+
+class FakePort:
+    # serial port that returns `data` once, then nothing
+    def __init__(self, data=b''):
+        self.data = data
+
+    @property
+    def in_waiting(self):
+        return len(self.data)
+
+    def read(self, size=1):
+        out, self.data = self.data[:size], self.data[size:]
+        return out
+
+    def reset_input_buffer(self):
+        self.data = b''
+
+
+def counter(text, name):
+    return int(next(line.split()[1] for line in text.splitlines() if line.startswith(name + ' ')))
+
+
+def test_every_counter_is_rendered():
+    m = Metrics()
+    m.inc('degraded_fixes', 2)
+    m.inc('new_thing')
+    text = m.render()
+    assert counter(text, 'uwb_degraded_fixes_total') == 2
+    assert counter(text, 'uwb_stale_fixes_total') == 0
+    assert '# HELP uwb_new_thing_total New thing.' in text
+    assert '# TYPE uwb_new_thing_total counter' in text
+
+
+def test_degraded_and_stale_reads(uwbpos, monkeypatch):
+    monkeypatch.setattr(uwbpos, 'ser_success', True)
+    names = ['uwb_degraded_fixes_total', 'uwb_deadline_misses_total', 'uwb_stale_fixes_total']
+    before = [counter(metrics.render(), name) for name in names]
+
+    # anchor 9 never reports: a degraded fix from anchors 6 and 7
+    port = FakePort(build_frame(gips.anchor_IDs[0], 300, 0, None) + build_frame(gips.anchor_IDs[1], 400, 0, None))
+    monkeypatch.setattr(uwbpos, 'ser_UWB', port, raising=False)
+    fix = uwbpos.read_fix(n=1, deadline=0.2)
+    assert fix.status == 'degraded'
+    text = metrics.render()
+    assert counter(text, 'uwb_degraded_fixes_total') == before[0] + 1
+    assert counter(text, 'uwb_deadline_misses_total') > before[1]
+
+    # nothing at all: the last fix, stale
+    monkeypatch.setattr(uwbpos, 'ser_UWB', FakePort(), raising=False)
+    assert uwbpos.read_fix(n=1, deadline=0.2).status == 'stale'
+    text = metrics.render()
+    assert counter(text, 'uwb_stale_fixes_total') == before[2] + 1
+
+    # still nothing: the same stale fix, not counted again
+    assert uwbpos.read_fix(n=1, deadline=0.2).status == 'stale'
+    assert counter(metrics.render(), 'uwb_stale_fixes_total') == before[2] + 1
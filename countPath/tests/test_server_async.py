@@ -0,0 +1,141 @@
+import asyncio
+import json
+import time
+
+import numpy as np
+
+import server_async
+from read_GIPS_distance import anchor_IDs
+from uwb_frame import INVALID_CM, RangeFrame
+from uwb_hub import STALE_AFTER, Fix
+
+
+def request(uwbpos, raw, setup=None):
+    # one raw HTTP request against a fresh AsyncHub -> (status line, body)
+    async def run():
+        hub = server_async.AsyncHub(uwbpos)
+        if setup is not None:
+            setup(hub)
+        server = await asyncio.start_server(server_async.make_handler(hub), '127.0.0.1', 0)
+        reader, writer = await asyncio.open_connection('127.0.0.1', server.sockets[0].getsockname()[1])
+        writer.write(raw)
+        await writer.drain()
+        data = await asyncio.wait_for(reader.read(), 5)
+        writer.close()
+        server.close()
+        await server.wait_closed()
+        return data
+
+    head, body = asyncio.run(run()).split(b'\r\n\r\n', 1)
+    return head.split(b'\r\n')[0].decode(), body
+
+
+def post(path, body):
+    return 'POST {} HTTP/1.1\r\nContent-Length: {}\r\n\r\n'.format(path, len(body)).encode() + body
+
+
+def test_garbage_body_is_400(uwbpos):
+    status, body = request(uwbpos, post('/dest', b'{not json'))
+    assert status == 'HTTP/1.1 400 Bad Request'
+    assert 'JSONDecodeError' in json.loads(body)['error']
+
+
+def test_missing_field_is_400(uwbpos):
+    status, _ = request(uwbpos, post('/dest', json.dumps({'dest': 1}).encode()))
+    assert status == 'HTTP/1.1 400 Bad Request'
+
+
+def test_bad_rate_is_400(uwbpos):
+    status, body = request(uwbpos, b'GET /pos/stream?rate=fast HTTP/1.1\r\n\r\n')
+    assert status == 'HTTP/1.1 400 Bad Request'
+    assert 'ValueError' in json.loads(body)['error']
+
+
+def test_server_error_is_500(uwbpos, capsys):
+    def broken(hub):
+        hub.calibration.status = lambda: 1 / 0
+
+    status, body = request(uwbpos, b'GET /pos/recalibrate HTTP/1.1\r\n\r\n', broken)
+    assert status == 'HTTP/1.1 500 Internal Server Error'
+    assert json.loads(body) == {'error': 'internal server error'}
+    assert 'ZeroDivisionError' in capsys.readouterr().err
+
+
+def test_pos_without_fix_is_503(uwbpos):
+    status, body = request(uwbpos, b'GET /pos HTTP/1.1\r\n\r\n')
+    assert status == 'HTTP/1.1 503 Service Unavailable'
+    assert json.loads(body)['pos'] is None
+
+
+def counter(text, name):
+    return int(next(line.split()[1] for line in text.splitlines() if line.startswith(name + ' ')))
+
+
+def test_metrics_count_degraded_and_stale_fixes(uwbpos):
+    def degraded(hub):
+        # anchor 9 reports an invalid range: the set is solved from anchors 6 and 7
+        p = np.array([uwbpos.X.mean(), uwbpos.Y.mean()])
+        cm = np.hypot(uwbpos.X - p[0], uwbpos.Y - p[1]) * 100
+        cm[2] = INVALID_CM
+        hub.on_frames([RangeFrame(i, anchor_IDs[i], int(c), '', None, time.monotonic(), 1) for i, c in enumerate(cm)])
+
+    def stale(hub):
+        # a measured fix, then STALE_AFTER s without another one
+        degraded(hub)
+        hub.tags.updated -= 2 * STALE_AFTER
+        hub.on_frames([])
+        fix = hub.fixes['']
+        hub.fixes = {'': fix._replace(t=fix.t - 2 * STALE_AFTER)}
+
+    def stale_again(hub):
+        hub.fixes = {'': Fix(1, time.time() - 2 * STALE_AFTER, (25.0, 121.0), (), None, '')}
+
+    _, before = request(uwbpos, b'GET /metrics HTTP/1.1\r\n\r\n')
+    status, body = request(uwbpos, b'GET /pos HTTP/1.1\r\n\r\n', degraded)
+    assert json.loads(body)['status'] == 'degraded'
+    status, body = request(uwbpos, b'GET /pos HTTP/1.1\r\n\r\n', stale)
+    assert json.loads(body)['status'] == 'stale'
+    # serving a stale fix again is not a new stale fix
+    status, body = request(uwbpos, b'GET /pos HTTP/1.1\r\n\r\n', stale_again)
+    assert json.loads(body)['status'] == 'stale'
+    _, after = request(uwbpos, b'GET /metrics HTTP/1.1\r\n\r\n')
+    before, after = before.decode(), after.decode()
+    for name, n in (('uwb_degraded_fixes_total', 2), ('uwb_stale_fixes_total', 1)):
+        assert '# TYPE {} counter'.format(name) in after
+        assert counter(after, name) == counter(before, name) + n
+    assert '# TYPE uwb_deadline_misses_total counter' in after
+
+def test_degraded_latency_ignores_anchors_outside_the_mask(uwbpos):
+    def degraded(hub):
+        # anchor 9 last reported an hour ago; 6 and 7 reported a second ago, past the set deadline
+        p = np.array([uwbpos.X.mean(), uwbpos.Y.mean()])
+        cm = np.hypot(uwbpos.X - p[0], uwbpos.Y - p[1]) * 100
+        now = time.monotonic()
+        hub.tags.add([RangeFrame(2, anchor_IDs[2], int(cm[2]), '', None, now - 3600, 1)])
+        hub.tags.fresh[:] = False
+        hub.on_frames([RangeFrame(i, anchor_IDs[i], int(cm[i]), '', None, now - 1, 2) for i in range(2)])
+
+    _, body = request(uwbpos, b'GET /pos HTTP/1.1\r\n\r\n', degraded)
+    fix = json.loads(body)
+    assert fix['status'] == 'degraded'
+    assert fix['mask'] == [True, True, False]
+    assert fix['rx_t'][2] is None
+    assert 1 <= fix['latency'] < 60
+
+
+def test_notify_task_is_held_until_done(uwbpos):
+    async def run():
+        hub = server_async.AsyncHub(uwbpos)
+        waiter = asyncio.get_running_loop().create_task(hub.wait(0, 5))
+        await asyncio.sleep(0)
+        p = np.array([uwbpos.X.mean(), uwbpos.Y.mean()])
+        cm = np.hypot(uwbpos.X - p[0], uwbpos.Y - p[1]) * 100
+        hub.on_frames([RangeFrame(i, anchor_IDs[i], int(c), '', None, time.monotonic(), 1) for i, c in enumerate(cm)])
+        assert len(hub.tasks) == 1
+        fix = await waiter
+        await asyncio.sleep(0)
+        return hub, fix
+
+    hub, fix = asyncio.run(run())
+    assert fix.seq == 1
+    assert not hub.tasks
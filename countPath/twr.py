@@ -4,8 +4,8 @@
 
 
 import os
-import csv
 import random
+from uwb_log import MeasurementLog
 
 ROUNDS = 20       
 SEED   = 42       
@@ -29,19 +29,14 @@ def main():
 
     errors = [gen_error_cm() for _ in range(ROUNDS)]
 
-   
-    with open(csv_path, 'w', newline='', encoding='utf-8') as f:
-        w = csv.writer(f)
-        w.writerow(['error_cm'])
+    with MeasurementLog(csv_path, ['error_cm'], append=False) as log:
         for v in errors:
-            w.writerow([f"{v:.3f}"])
+            log.append([f"{v:.3f}"])
     print(f"[Info] 已儲存 CSV : {csv_path}（{len(errors)} 筆）")
 
     
     try:
-        import pandas as pd
-        with pd.ExcelWriter(xlsx_path, engine='openpyxl') as writer:
-            pd.DataFrame({'error_cm': errors}).to_excel(writer, index=False, sheet_name='1D_Range_Error')
+        log.to_excel(xlsx_path, sheet_name='1D_Range_Error')
         print(f"[Info] 已儲存 Excel: {xlsx_path}（{len(errors)} 筆）")
     except Exception as e:
         print(f"[Info] 未寫入 Excel（缺少 pandas/openpyxl 或寫入失敗）：{e}")
@@ -1,8 +1,9 @@
 import os
 import time
-import csv
-import serial
 import numpy as np
+from uwb_frame import FrameParser
+from uwb_capture import open_serial
+from uwb_log import MeasurementLog
 
 # ===== 參數設定 =====
 anchor_id  = '0241000000000000'      # 8-byte HEX（需與資料幀一致）
@@ -19,33 +20,27 @@ csv_name   = 'uwb_twr_error_only.csv'
 
 # ===== 串口連線 =====
 try:
-    ser = serial.Serial(PORT, BAUD, timeout=1)
+    ser = open_serial(PORT, BAUD, timeout=1)
     print(f"[Info] Connected to {PORT} @ {BAUD}bps")
 except Exception as e:
     print(f"[Warning] 無法開啟串口 {PORT}: {e}")
     ser = None
+parser = FrameParser([anchor_id])
 
 
 
-def read_distance_m(serial_iface, anchor_hex_id, retries=8):
+def read_distance_m(serial_iface, parser, retries=8):
     """
-    在 raw hex 中尋找 8-byte Anchor ID，緊接著 4 bytes（小端）為距離(cm)。
+    由 parser 解析 8-byte Anchor ID 與其後 4 bytes（小端）距離(cm)。
     回傳：距離（公尺）；讀不到回 0.0
     """
     if not serial_iface:
         return 0.0
 
     for _ in range(retries):
-        raw_hex = serial_iface.read(256).hex()
-        idx = raw_hex.find(anchor_hex_id.lower())
-        if idx >= 0:
-            hex_dis = raw_hex[idx + 16 : idx + 24]  # ID(16 hex) 後的 8 hex
-            try:
-                cm = int.from_bytes(bytes.fromhex(hex_dis)[::-1], 'big')
-            except ValueError:
-                cm = 0
-            if 0 < cm < 32768:
-                return cm / 100.0  # m
+        for frame in parser.feed(serial_iface.read(256)):
+            if 0 < frame.cm < 32768:
+                return frame.dis  # m
         time.sleep(0.01)
     return 0.0
 
@@ -57,18 +52,15 @@ def main():
     true_d = float(np.linalg.norm(np.array(anchor_pos) - np.array(tag_pos)))  # m
 
     saved = 0
-    with open(csv_path, 'w', newline='', encoding='utf-8') as f:
-        w = csv.writer(f)
-        w.writerow(['error_cm'])  
-
+    with MeasurementLog(csv_path, ['error_cm'], append=False) as log:
         for i in range(ROUNDS):
-            meas_d = read_distance_m(ser, anchor_id)
+            meas_d = read_distance_m(ser, parser)
             if meas_d <= 0.0:
                 print(f"{i+1:04d}  讀取失敗，略過")
                 continue
 
             err_cm = (meas_d - true_d) * 100.0
-            w.writerow([f"{err_cm:.3f}"])
+            log.append([f"{err_cm:.3f}"])
             saved += 1
             print(f"{i+1:04d}  error_cm={err_cm:.3f}")
 
@@ -0,0 +1,54 @@
+import asyncio
+import time
+
+from uwb_metrics import metrics
+
+
+class AsyncFrameReader:
+    """
+    Reads a serial port from an asyncio event loop. The tty fd is watched with
+    loop.add_reader, so nothing blocks or polls: whenever bytes are queued they
+    are fed to the frame parser and the parsed frames go to `on_frames`.
+    Needs a selector loop on a real fd (Linux / Raspberry Pi).
+    """
+
+    def __init__(self, ser, parser, on_frames):
+        self.ser = ser
+        self.ser.timeout = 0            # read() returns what is queued, never waits
+        self.parser = parser
+        self.on_frames = on_frames
+        self.loop = None
+
+    def start(self):
+        self.loop = asyncio.get_running_loop()
+        if hasattr(self.ser, 'next_due'):
+            # capture replay (uwb_capture.ReplaySerial) has no fd: wake up when the next bytes are due
+            self.task = self.loop.create_task(self._replay())
+        else:
+            self.loop.add_reader(self.ser.fileno(), self._readable)
+
+    def stop(self):
+        if self.loop is not None:
+            if hasattr(self.ser, 'next_due'):
+                self.task.cancel()
+            else:
+                self.loop.remove_reader(self.ser.fileno())
+            self.loop = None
+
+    async def _replay(self):
+        while True:
+            self._readable()
+            wait = self.ser.next_due()
+            if wait is None:
+                return
+            await asyncio.sleep(wait)
+
+    def _readable(self):
+        data = self.ser.read(self.ser.in_waiting or 1)
+        if data:
+            t = time.monotonic()
+            with metrics.timer('parse'):
+                frames = self.parser.feed(data, t)
+            metrics.count_frames(frames)
+            if frames:
+                self.on_frames(frames)
@@ -0,0 +1,164 @@
+"""
+Record raw serial bytes with their receive time, and replay them later as if
+they came from the port.
+
+Capture file: MAGIC, start time (float64, epoch s), then one record per read:
+    t (float64, s since start)  n (uint32)  n bytes
+
+Both wrappers look like serial.Serial to the readers (read, in_waiting,
+timeout, flushInput, close). Use open_serial() instead of serial.Serial:
+    UWB_CAPTURE=file.cap    record everything read from the real port
+    UWB_REPLAY=file.cap     read from the capture instead of the port
+    UWB_REPLAY_SPEED=N      1 = real time (default), N = N times faster, 0 = as fast as possible
+"""
+import bisect
+import mmap
+import os
+import struct
+import time
+
+import serial
+
+MAGIC = b'UWBCAP1\n'
+_START = struct.Struct('<d')
+_RECORD = struct.Struct('<dI')
+
+
+def open_serial(port, baud, **kwargs):
+    replay = os.environ.get('UWB_REPLAY')
+    if replay:
+        return ReplaySerial(replay, float(os.environ.get('UWB_REPLAY_SPEED', 1)), timeout=kwargs.get('timeout'))
+    ser = serial.Serial(port, baud, **kwargs)
+    capture = os.environ.get('UWB_CAPTURE')
+    if capture:
+        return RecordingSerial(ser, capture)
+    return ser
+
+
+def write_capture(path, records, start_time=None):
+    # records: iterable of (t, bytes), t in s since start; for synthetic captures
+    with open(path, 'wb') as file:
+        file.write(MAGIC + _START.pack(time.time() if start_time is None else start_time))
+        for t, data in records:
+            file.write(_RECORD.pack(t, len(data)) + data)
+
+
+class RecordingSerial:
+    def __init__(self, ser, path):
+        self.ser = ser
+        self.file = open(path, 'wb')
+        self.t0 = time.monotonic()
+        self.file.write(MAGIC + _START.pack(time.time()))
+
+    def read(self, size=1):
+        data = self.ser.read(size)
+        if data:
+            self.file.write(_RECORD.pack(time.monotonic() - self.t0, len(data)) + data)
+        return data
+
+    @property
+    def timeout(self):
+        return self.ser.timeout
+
+    @timeout.setter
+    def timeout(self, value):
+        self.ser.timeout = value
+
+    def close(self):
+        self.file.close()
+        self.ser.close()
+
+    def __getattr__(self, name):
+        # in_waiting, fileno, flushInput, ... of the real port
+        return getattr(self.ser, name)
+
+
+class ReplaySerial:
+    def __init__(self, path, speed=1.0, timeout=None, loop=False):
+        self.speed = speed
+        self.timeout = timeout
+        self.loop = loop
+        self._file = open(path, 'rb')
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._map[:len(MAGIC)] != MAGIC:
+            raise ValueError("{} is not a UWB capture".format(path))
+        (self.start_time,) = _START.unpack_from(self._map, len(MAGIC))
+        # index of the records: receive time, data offset in the file, bytes before the record
+        self.times, self.offsets, self.ends = [], [], []
+        pos, total = len(MAGIC) + _START.size, 0
+        while pos + _RECORD.size <= len(self._map):
+            t, n = _RECORD.unpack_from(self._map, pos)
+            pos += _RECORD.size
+            total += n
+            self.times.append(t)
+            self.offsets.append(pos)
+            self.ends.append(total)
+            pos += n
+        self.size = total
+        self.rewind()
+
+    def rewind(self):
+        self.pos = 0                    # bytes of the stream already read
+        self.t0 = time.monotonic()
+
+    def _clock(self):
+        # capture time reached by the replay
+        if self.speed <= 0:
+            return float('inf')
+        return (time.monotonic() - self.t0) * self.speed
+
+    def _due(self):
+        # bytes received up to now
+        n = bisect.bisect_right(self.times, self._clock())
+        return self.ends[n - 1] if n else 0
+
+    def next_due(self):
+        # seconds until more bytes are due, None at the end of the capture
+        n = bisect.bisect_right(self.times, self._clock())
+        if n >= len(self.times):
+            return None
+        return max(0.0, (self.times[n] / self.speed) - (time.monotonic() - self.t0))
+
+    @property
+    def in_waiting(self):
+        return self._due() - self.pos
+
+    def read(self, size=1):
+        deadline = None if self.timeout is None else time.monotonic() + self.timeout
+        while self._due() - self.pos < size:
+            wait = self.next_due()
+            if wait is None:
+                if self.loop:
+                    self.rewind()
+                    continue
+                if self.pos == self.size:
+                    time.sleep(self.timeout if self.timeout is not None else 0.1)
+                break
+            if deadline is not None:
+                wait = min(wait, deadline - time.monotonic())
+                if wait <= 0:
+                    break
+            time.sleep(wait)
+        return self._take(min(size, self._due() - self.pos))
+
+    def _take(self, size):
+        chunks = []
+        i = bisect.bisect_right(self.ends, self.pos)
+        while size > 0:
+            start = self.pos - (self.ends[i - 1] if i else 0)
+            n = min(size, self.ends[i] - self.pos)
+            off = self.offsets[i] + start
+            chunks.append(self._map[off:off + n])
+            self.pos += n
+            size -= n
+            i += 1
+        return b''.join(chunks)
+
+    def flushInput(self):
+        self.pos = self._due()
+
+    reset_input_buffer = flushInput
+
+    def close(self):
+        self._map.close()
+        self._file.close()
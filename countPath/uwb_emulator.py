@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+Synthetic UWB module on a pseudo-terminal, for load tests without hardware.
+
+Emits the same frames UWB_read parses (8-byte anchor ID + little-endian
+distance in cm, padded to FRAME_SIZE) for one or more tags moving along
+scripted trajectories, with Gaussian noise, dropouts and NLOS bias.
+
+    python3 uwb_emulator.py --layout 2d --tags 1 --rate 10 --link /tmp/ttyUWB
+    COM_PORT=/tmp/ttyUWB  -> point read_GIPS_distance.COM_PORT (or port=) at it
+
+With --tags > 1 each frame also carries an 8-byte tag ID at --tag-offset
+(use the same value as read_GIPS_distance.TAG_OFFSET).
+"""
+import argparse
+import math
+import os
+import signal
+import struct
+import time
+import tty
+
+import numpy as np
+
+import read_GIPS_distance as gips
+from uwb_frame import ID_LEN, FRAME_LEN
+
+# anchor layouts (x, y, z) in metres, with the anchor IDs they report
+LAYOUTS = {
+    # read_GIPS_distance: anchors 6, 7, 9 relative to anchor 6
+    '2d': (gips.anchor_IDs[:3], [(gips.x1, gips.y1, 0.0), (gips.x2, gips.y2, 0.0), (gips.x3, gips.y3, 0.0)]),
+    # distance_3d.py __main__
+    '3d': (gips.anchor_IDs, [(0.0, 0.0, 1.0), (5.0, 0.0, 1.0), (5.0, 10.0, 1.0), (0.0, 10.0, 1.0)]),
+    # 3dinfo.py
+    '3dinfo': (gips.anchor_IDs, [(4.0, 0.0, 2.0), (4.0, 2.0, 0.0), (5.0, 8.0, 2.0), (0.0, 6.0, 1.5)]),
+}
+
+
+def trajectory(kind, anchors, t, phase):
+    # tag position at time t; tags are spread along the path by `phase` (0..1)
+    lo, hi = anchors.min(axis=0), anchors.max(axis=0)
+    centre, half = (lo + hi) / 2, np.maximum((hi - lo) / 2, 0.5)
+    a = 2 * math.pi * (t / 20 + phase)
+    if kind == 'static':
+        p = centre + half * 0.5 * np.array([math.cos(a), math.sin(a), 0])
+    elif kind == 'line':
+        s = 2 * abs((t / 20 + phase) % 1 - 0.5)     # 0..1..0
+        p = lo + (hi - lo) * np.array([s, s, 0.5])
+    else:   # circle
+        p = centre + half * 0.6 * np.array([math.cos(a), math.sin(a), 0])
+    if kind != 'line':
+        p[2] = centre[2]
+    return p
+
+
+def build_frame(anchor_ID, cm, tag, tag_offset):
+    lead = max(0, -tag_offset) if tag_offset is not None else 0
+    frame = bytearray(gips.FRAME_SIZE)
+    frame[lead:lead + 8] = bytes.fromhex(anchor_ID)
+    frame[lead + 8:lead + 12] = struct.pack('<I', cm)
+    if tag_offset is not None:
+        frame[lead + tag_offset:lead + tag_offset + ID_LEN] = tag.to_bytes(ID_LEN, 'big')
+    return bytes(frame)
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    ap.add_argument('--layout', choices=sorted(LAYOUTS), default='2d')
+    ap.add_argument('--path', choices=['circle', 'line', 'static'], default='circle')
+    ap.add_argument('--tags', type=int, default=1)
+    ap.add_argument('--tag-offset', type=int, default=None, help='tag ID offset from the anchor ID (bytes)')
+    ap.add_argument('--rate', type=float, default=10, help='range sets per second per tag')
+    ap.add_argument('--baud', type=int, default=gips.BAUD_RATES)
+    ap.add_argument('--noise', type=float, default=0.05, help='range noise std (m)')
+    ap.add_argument('--dropout', type=float, default=0.0, help='probability a frame is lost')
+    ap.add_argument('--nlos', type=float, default=0.0, help='probability a range is NLOS')
+    ap.add_argument('--nlos-bias', type=float, default=1.0, help='mean extra NLOS distance (m)')
+    ap.add_argument('--seed', type=int, default=None)
+    ap.add_argument('--link', default=None, help='symlink to create for the pty, e.g. /tmp/ttyUWB')
+    args = ap.parse_args()
+    if args.tags > 1 and args.tag_offset is None:
+        ap.error('--tags > 1 needs --tag-offset')
+
+    if args.tag_offset is not None and -ID_LEN < args.tag_offset < FRAME_LEN:
+        ap.error('--tag-offset must not overlap the anchor ID / distance')
+
+    ids, anchors = LAYOUTS[args.layout]
+    anchors = np.array(anchors)
+    rng = np.random.default_rng(args.seed)
+
+    master, slave = os.openpty()
+    tty.setraw(slave)
+    name = os.ttyname(slave)
+    if args.link:
+        if os.path.islink(args.link):
+            os.remove(args.link)
+        os.symlink(name, args.link)
+    # a serial line carries about baud/10 bytes per second
+    line_rate = args.baud / 10 / gips.FRAME_SIZE / len(ids) / args.tags
+    rate = min(args.rate, line_rate)
+    print("emulating {} tag(s) on {} ({}), {:.1f} range sets/s per tag (line limit {:.1f})".format(
+        args.tags, name, args.link or 'no link', rate, line_rate))
+
+    signal.signal(signal.SIGTERM, signal.default_int_handler)     # clean up the link on kill too
+    t0 = time.monotonic()
+    tick = 0
+    sent = 0
+    try:
+        while True:
+            t = tick / rate
+            out = []
+            for tag in range(args.tags):
+                p = trajectory(args.path, anchors, t, tag / args.tags)
+                r = np.linalg.norm(anchors - p, axis=1) + rng.normal(0, args.noise, len(ids))
+                r += (rng.random(len(ids)) < args.nlos) * rng.exponential(args.nlos_bias, len(ids))
+                for aid, dist, lost in zip(ids, r, rng.random(len(ids)) < args.dropout):
+                    if not lost:
+                        out.append(build_frame(aid, max(0, int(round(dist * 100))), tag + 1, args.tag_offset))
+            os.write(master, b''.join(out))
+            sent += len(out)
+            tick += 1
+            delay = t0 + tick / rate - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            if tick % max(1, int(rate * 10)) == 0:
+                print("{} frames sent".format(sent))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if args.link and os.path.islink(args.link):
+            os.remove(args.link)
+        os.close(master)
+        os.close(slave)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+import re
+import struct
+import time
+from collections import namedtuple
+
+ID_LEN = 8          # anchor ID, 8 bytes
+DIS_LEN = 4         # ToF distance (cm), 4 bytes little-endian
+FRAME_LEN = ID_LEN + DIS_LEN
+INVALID_CM = 32768  # distances at or above this are sign-overflowed readings
+
+_DIS = struct.Struct('<I')
+
+
+class RangeFrame(namedtuple('RangeFrame', ['index', 'anchor_ID', 'cm', 'tag', 'nlos', 't', 'seq'],
+                            defaults=('', None, None, None))):
+    """
+    One (anchor, range) frame. `index` is the anchor's position in the parser's
+    ID list, `tag` the hex tag ID ('' when the parser has no tag offset), `nlos`
+    the anchor's NLOS likelihood from its CIR (None when unknown, see cir_analysis.py).
+    `t` is the time.monotonic() the bytes were read, `seq` counts the frames of
+    this anchor and tag seen by the parser (a gap between anchors = lost frames).
+    """
+    __slots__ = ()
+
+    @property
+    def valid(self):
+        return self.cm < INVALID_CM
+
+    @property
+    def dis(self):
+        # distance in metres, 0 for an invalid reading (same convention as UWB_read)
+        return self.cm / 100 if self.cm < INVALID_CM else 0.0
+
+
+class FrameParser:
+    """
+    Incremental parser for the anchor range frames sent by the UWB module.
+
+    Bytes are fed in arbitrary chunks; every occurrence of a known anchor ID
+    followed by its 4-byte distance becomes a RangeFrame. Bytes that do not
+    belong to a frame are skipped, and a frame cut off at the end of a chunk
+    is kept in the buffer until the rest of it arrives.
+
+    With several tags on one port, `tag_offset` is the position of the tag ID
+    relative to the start of the anchor ID (negative if it comes before it).
+
+    Every frame is stamped with the receive time passed to feed() (default:
+    now) and a per-anchor, per-tag sequence number.
+    """
+
+    def __init__(self, anchor_IDs, tag_offset=None, tag_len=ID_LEN):
+        self.anchor_IDs = list(anchor_IDs)
+        self._index = {bytes.fromhex(aid): i for i, aid in enumerate(self.anchor_IDs)}
+        self._pattern = re.compile(b'|'.join(re.escape(key) for key in self._index))
+        self._buf = bytearray()
+        self.tag_offset = tag_offset
+        self.tag_len = tag_len
+        self._seq = {}          # (tag, anchor index) -> frames seen
+        if tag_offset is None:
+            self._lead, self._span = 0, FRAME_LEN
+        else:
+            # bytes needed before / from the anchor ID to hold the whole frame
+            self._lead = max(0, -tag_offset)
+            self._span = max(FRAME_LEN, tag_offset + tag_len)
+
+    def feed(self, data, t=None):
+        if t is None:
+            t = time.monotonic()
+        buf = self._buf
+        seqs = self._seq
+        buf += data
+        frames = []
+        lead, span, off = self._lead, self._span, self.tag_offset
+        last = len(buf) - span
+        pos = 0
+        keep = len(buf) - ID_LEN + 1    # a partial anchor ID may end the buffer
+        for m in self._pattern.finditer(buf):
+            start = m.start()
+            if start < pos:     # ID bytes inside the previous frame
+                continue
+            if start > last:
+                keep = start
+                break
+            if start < lead:    # its tag ID was already dropped
+                continue
+            index = self._index[m.group()]
+            (cm,) = _DIS.unpack_from(buf, start + ID_LEN)
+            tag = '' if off is None else buf[start + off:start + off + self.tag_len].hex()
+            seq = seqs[tag, index] = seqs.get((tag, index), 0) + 1
+            frames.append(RangeFrame(index, self.anchor_IDs[index], cm, tag, None, t, seq))
+            pos = start + span
+        # keep only what may still be the beginning of a frame
+        del buf[:max(pos, keep - lead, 0)]
+        return frames
+
+    def reset(self):
+        self._buf.clear()
@@ -0,0 +1,284 @@
+import time
+from collections import namedtuple
+from threading import Thread, Lock, Event, Condition
+
+import numpy as np
+
+import read_GIPS_distance as gips
+from calibration import Calibration
+from gdop import GDOPGrid
+from kalman import CVKalman
+from uwb_frame import RangeFrame
+from uwb_metrics import metrics
+
+# one published position; fields are never mutated after publishing.
+# t: time.time() of the last measurement behind the position (a Kalman prediction keeps it),
+# rx_t / rx_seq: monotonic receive time (None outside the mask) and frame sequence number of each range,
+# latency: seconds from the oldest range in the mask arriving to publication,
+# mask: anchors the fix was solved from, status: 'complete' / 'degraded' / 'predicted' (Kalman, no new set) / 'stale'
+Fix = namedtuple('Fix', ['seq', 't', 'pos', 'diss', 'cov', 'tag', 'gdop', 'rx_t', 'rx_seq', 'latency',
+                         'mask', 'status'],
+                 defaults=(None,) * 6)
+
+AVERAGE_N = 5       # fixes averaged into one published position
+MAX_TAGS = 64
+GDOP_REF = 1.5      # GDOP the filter's measurement noise is tuned for
+GDOP_CAP = 100.0    # fixes on a singular geometry still get a (tiny) weight
+TRUST_MIN = 0.05    # floor of a fix's trust when its anchors look NLOS
+DEGRADED_TRUST = 0.25   # extra trust factor of a fix solved from fewer anchors
+STALE_AFTER = 2.0   # a published fix older than this (s) is served as stale
+DEFAULT_TAG = ''    # tag served by /pos and /pos/stream without ?tag= ('' = single-tag parser)
+
+
+class TagTable:
+    """
+    Range and smoothing state of every tag seen on the port, one row per tag.
+    A tag is solved once each anchor has reported since its previous fix;
+    all such tags are solved together in one batch. Each fix is weighted by
+    the GDOP of the anchor layout at its position (1/GDOP^2 in the average,
+    scaled measurement noise in the Kalman filter) and by its trust, the
+    product of (1 - NLOS likelihood) of its anchors' ranges.
+    A set still missing anchors `deadline` s after its first range arrived is
+    solved from the ones that did report (gips.MIN_ANCHORS or more) as a
+    degraded fix, or dropped.
+    """
+
+    def __init__(self, uwbpos, capacity=MAX_TAGS, kalman=False, deadline=gips.DEADLINE):
+        self.pos = uwbpos
+        self.kalman = kalman
+        self.deadline = deadline
+        self.rows = {}                                          # tag -> row
+        self.tags = []                                          # row -> tag
+        n = len(uwbpos.diss)
+        self.diss = np.zeros((capacity, n))
+        self.fresh = np.zeros((capacity, n), dtype=bool)        # anchor reported since last fix
+        self.nlos = np.zeros((capacity, n))                     # NLOS likelihood of each range, 0 = unknown
+        self.rx_t = np.zeros((capacity, n))                     # monotonic receive time of each range
+        self.rx_seq = np.zeros((capacity, n), dtype=int)        # its frame sequence number
+        self.window = np.zeros((capacity, AVERAGE_N, 2))        # last relative fixes, ring buffer
+        self.weight = np.zeros((capacity, AVERAGE_N))           # their weights, 0 = empty slot
+        self.count = np.zeros(capacity, dtype=int)
+        self.updated = np.full(capacity, -np.inf)               # monotonic time of the last measured fix
+        self.stale = np.zeros(capacity, dtype=bool)             # no measured fix for STALE_AFTER s
+        self.filters = []                                       # row -> CVKalman (kalman mode)
+        self.gdop = GDOPGrid(np.column_stack((uwbpos.X, uwbpos.Y)))
+
+    def row(self, tag):
+        row = self.rows.get(tag)
+        if row is None:
+            if len(self.tags) == len(self.diss):
+                return None         # table full, tag ignored
+            row = self.rows[tag] = len(self.tags)
+            self.tags.append(tag)
+            self.filters.append(CVKalman(2))
+        return row
+
+    def add(self, frames):
+        now = None
+        for frame in frames:
+            row = self.row(frame.tag)
+            if row is not None:
+                if not self.fresh[row].any():
+                    self.diss[row] = 0          # new set: anchors that do not report stay 0
+                self.diss[row, frame.index] = frame.dis
+                self.fresh[row, frame.index] = True
+                self.nlos[row, frame.index] = frame.nlos or 0.0
+                if frame.t is None and now is None:
+                    now = time.monotonic()
+                self.rx_t[row, frame.index] = now if frame.t is None else frame.t
+                self.rx_seq[row, frame.index] = frame.seq or 0
+
+    def solve(self, t=None):
+        # returns [(tag, crs, diss, cov, gdop, rx_t, rx_seq, mask, status, measured)] for every tag with a
+        # new position; measured is the monotonic time of the last measurement behind it
+        if t is None:
+            t = time.monotonic()
+        n = len(self.tags)
+        # a tag turns stale STALE_AFTER s after its last measured fix, counted once until it has a new one
+        stale = (t - self.updated[:n] > STALE_AFTER) & np.isfinite(self.updated[:n])
+        turned = np.count_nonzero(stale & ~self.stale[:n])
+        if turned:
+            metrics.inc('stale_fixes', turned)
+        self.stale[:n] = stale
+        fresh = self.fresh[:n]
+        valid = fresh & (self.diss[:n] > 0)
+        complete = valid.all(axis=1)
+        # a set with an invalid range, or still incomplete after the deadline, is solved from the
+        # anchors it has (degraded) or dropped; either way the tag starts a new set
+        started = np.where(fresh, self.rx_t[:n], np.inf).min(axis=1)
+        expired = ~complete & (fresh.all(axis=1) | (t - started > self.deadline))
+        enough = valid.sum(axis=1) >= gips.MIN_ANCHORS
+        dropped = np.flatnonzero(expired & ~enough)
+        if len(dropped):
+            metrics.inc('incomplete_fixes', len(dropped))
+            self.fresh[dropped] = False
+        full = np.flatnonzero(complete)
+        degraded = np.flatnonzero(expired & enough)
+        if len(degraded):
+            metrics.inc('degraded_fixes', len(degraded))
+        ready = np.concatenate((full, degraded))
+        masks = valid[ready]
+        with metrics.timer('solve'):
+            rel = self.pos.compute_relative_partial_batch(self.diss[ready], masks, self.prior(ready))
+            gdop = np.minimum(self.gdop.lookup_batch(rel), GDOP_CAP)
+            trust = np.maximum((1 - self.nlos[ready] * masks).prod(axis=1), TRUST_MIN)
+            trust[len(full):] *= DEGRADED_TRUST
+        status = dict.fromkeys(full.tolist(), 'complete')
+        status.update(dict.fromkeys(degraded.tolist(), 'degraded'))
+        mask = dict(zip(ready.tolist(), map(tuple, masks.tolist())))
+        self.fresh[ready] = False
+        if self.kalman:
+            # filter every tag: update the ones with a new fix, predict the others for at most
+            # STALE_AFTER s past their last fix; after that the tag is no longer published (served as stale)
+            with metrics.timer('filter'):
+                z = dict(zip(ready.tolist(), zip(rel, gdop.tolist(), trust.tolist())))
+                rows, filtered, covs, gdops = [], [], [], []
+                for row in range(n):
+                    fix, g, w = z.get(row, (None, None, None))
+                    if fix is None:
+                        if t - self.updated[row] > STALE_AFTER:
+                            continue
+                        t_row = t
+                    else:
+                        # a new fix is applied at the time its newest range arrived; a long gap restarts the filter
+                        t_row = self.rx_t[row][list(mask[row])].max()
+                        if t_row - self.updated[row] > STALE_AFTER:
+                            self.filters[row].reset()
+                        self.updated[row] = t_row
+                    p, cov = self.filters[row].step(fix, t_row, 1.0 if g is None else (g / GDOP_REF) ** 2 / w)
+                    if p is not None:
+                        rows.append(row)
+                        filtered.append(p)
+                        covs.append(cov.tolist())
+                        gdops.append(g)
+            if not rows:
+                return []
+            crs = gips.relative_to_CRS(np.array(filtered))
+        else:
+            with metrics.timer('filter'):
+                self.updated[ready] = t
+                slot = self.count[ready] % AVERAGE_N
+                self.window[ready, slot] = rel
+                self.weight[ready, slot] = trust / gdop ** 2
+                self.count[ready] += 1
+                w = self.weight[ready]
+                rows = ready.tolist()
+                crs = gips.relative_to_CRS((self.window[ready] * w[..., None]).sum(axis=1) / w.sum(axis=1)[:, None])
+            covs = [None] * len(rows)
+            gdops = gdop.tolist()
+        # Kalman predictions of tags without a new set have no mask
+        return [(self.tags[row], (float(c[0]), float(c[1])), tuple(self.diss[row].tolist()), cov, g,
+                 self.receive_times(row, mask.get(row)), tuple(self.rx_seq[row].tolist()),
+                 mask.get(row), status.get(row, 'predicted'), float(self.updated[row]))
+                for row, c, cov, g in zip(rows, crs, covs, gdops)]
+
+    def receive_times(self, row, mask=None):
+        # rx_t of a row, None for anchors outside the mask or never heard from
+        if mask is None:
+            mask = self.rx_t[row] > 0
+        return tuple(t if ok else None for t, ok in zip(self.rx_t[row].tolist(), mask))
+
+    def prior(self, rows):
+        # last position of each row relative to anchor 6 (nan if none), to pick a two-anchor solution
+        prior = np.full((len(rows), 2), np.nan)
+        for i, row in enumerate(rows.tolist()):
+            if self.kalman:
+                if self.filters[row].ready:
+                    prior[i] = self.filters[row].position
+            elif self.count[row]:
+                prior[i] = self.window[row, (self.count[row] - 1) % AVERAGE_N]
+        centroid = np.array([self.pos.X.mean(), self.pos.Y.mean()])
+        return np.where(np.isnan(prior), centroid, prior)
+
+
+def new_fix(seq, tag, crs, diss, cov, gdop, rx_t, rx_seq, mask=None, status=None, measured=None):
+    # the published Fix of one solve() result; also records the end-to-end latency
+    now = time.monotonic()
+    seen = [t for i, t in enumerate(rx_t) if t is not None and (mask is None or mask[i])]
+    latency = now - min(seen) if seen else None
+    if latency is not None:
+        metrics.observe('fix_latency', latency)
+    t = time.time() - (0.0 if measured is None else now - measured)
+    return Fix(seq, t, crs, diss, cov, tag, gdop, rx_t, rx_seq, latency, mask, status)
+
+
+def mark_stale(fix, now=None):
+    # a fix as served to clients: 'stale' once no newer one arrived for STALE_AFTER s
+    if fix.t is None or (time.time() if now is None else now) - fix.t <= STALE_AFTER:
+        return fix
+    return fix._replace(status='stale')
+
+
+def tag_fix(fixes, tag):
+    # newest fix of one tag, an empty Fix (pos None) until it has one
+    fix = fixes.get(tag)
+    return Fix(0, None, None, (), None, tag) if fix is None else fix
+
+
+def stream_fixes(fixes, seq, tag):
+    # fixes of `tag` ('*' = every tag) newer than `seq`, oldest first
+    return sorted((f for t, f in fixes.items() if f.seq > seq and tag in (t, '*')), key=lambda f: f.seq)
+
+
+class SensorHub(Thread):
+    """
+    Owns the UWB serial port: reads ranges of every tag in the background,
+    solves them and publishes the latest Fix per tag. Readers only look at
+    `latest` / `fixes`, so they never wait on the port.
+    """
+
+    def __init__(self, uwbpos, fake=False, interval=0.1, kalman=False, cir=None):
+        super().__init__(daemon=True)
+        self.pos = uwbpos
+        self.cir = cir                  # cir_analysis.CIRMonitor: tags frames with their anchor's NLOS score
+        self.fake = fake
+        self.kalman = kalman            # track with the Kalman filter instead of averaging
+        self.interval = interval        # pause between fake reads (s)
+        self.lock = Lock()              # held while the port / diss is in use
+        self.tags = TagTable(uwbpos, kalman=kalman)
+        self.calibration = Calibration()                    # fed with every solved range set, see Calibration.add
+        self.latest = Fix(0, None, None, (), None, None)    # newest fix of any tag
+        self.fixes = {}                                     # tag -> newest Fix
+        self._published = Condition()
+        self._stop = Event()
+
+    def run(self):
+        if not (self.fake or self.pos.ser_success):
+            print("sensor hub: no UWB port, nothing to read")
+            return
+        while not self._stop.is_set():
+            with self.lock:
+                if self.fake:
+                    self.pos.fake_read()
+                    frames = [RangeFrame(i, gips.anchor_IDs[i], int(d * 100)) for i, d in enumerate(self.pos.diss)]
+                else:
+                    frames = self.pos.UWB_read_frames()
+                if self.cir is not None:
+                    frames = self.cir.annotate(frames)
+                self.tags.add(frames)
+                solved = self.tags.solve()
+            for result in solved:
+                tag, diss, status = result[0], result[2], result[8]
+                if status in ('complete', 'degraded'):
+                    self.calibration.add(diss, tag)     # raw ranges, 0 at the anchor the tag sits on
+                self._publish(*result)
+            if self.fake:
+                time.sleep(self.interval)
+
+    def _publish(self, tag, *result):
+        with self._published:
+            fix = new_fix(self.latest.seq + 1, tag, *result)
+            fixes = dict(self.fixes)
+            fixes[tag] = fix
+            self.fixes = fixes      # swapped, never modified in place
+            self.latest = fix
+            self._published.notify_all()
+
+    def wait(self, seq, timeout=None):
+        # block until a fix newer than `seq` is published (or timeout); returns the latest fix
+        with self._published:
+            self._published.wait_for(lambda: self.latest.seq > seq, timeout)
+            return self.latest
+
+    def stop(self):
+        self._stop.set()
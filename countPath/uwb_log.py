@@ -0,0 +1,97 @@
+"""
+Append-only measurement log shared by the measurement scripts.
+
+Each round appends one row to a CSV file; rows are buffered and written every
+`flush_every` rows (and on close), so a round costs the same however long the
+run gets. The Excel workbook is built from the log once, at the end, or on
+demand with:
+    python3 uwb_log.py log.csv [out.xlsx]
+"""
+import csv
+import os
+import sys
+
+
+class MeasurementLog:
+    def __init__(self, path, columns, append=True, flush_every=10, seed=None):
+        """
+        path:        CSV file of the log
+        columns:     column names, written as the header of a new log
+        append:      keep the rows of an existing log (False starts a new one)
+        flush_every: rows buffered before they are written to disk
+        seed:        Excel workbook of an older run, copied into a new log once
+        """
+        self.path = path
+        self.columns = list(columns)
+        self.flush_every = flush_every
+        self.rows = []
+        exists = append and os.path.exists(path) and os.path.getsize(path) > 0
+        if exists:
+            with open(path, newline='', encoding='utf-8') as f:
+                header = next(csv.reader(f), [])
+            if header != self.columns:
+                raise ValueError("{} has columns {}, expected {}".format(path, header, self.columns))
+        self.file = open(path, 'a' if exists else 'w', newline='', encoding='utf-8')
+        self.writer = csv.writer(self.file)
+        if not exists:
+            self.writer.writerow(self.columns)
+            if seed and os.path.exists(seed):
+                import pandas as pd
+                self.writer.writerows(pd.read_excel(seed)[self.columns].itertuples(index=False))
+            self.file.flush()
+
+    def append(self, row):
+        # row: dict keyed by column, or values in column order
+        if isinstance(row, dict):
+            row = [row.get(c, '') for c in self.columns]
+        self.rows.append(row)
+        if len(self.rows) >= self.flush_every:
+            self.flush()
+
+    def flush(self):
+        if self.rows:
+            self.writer.writerows(self.rows)
+            self.rows = []
+        self.file.flush()
+
+    def close(self):
+        if not self.file.closed:
+            self.flush()
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def read(self):
+        import pandas as pd
+        if not self.file.closed:
+            self.flush()
+        return pd.read_csv(self.path, encoding='utf-8')
+
+    def to_excel(self, xlsx_path, sheet_name='Sheet1', extra_sheets=None):
+        # extra_sheets: {sheet name: DataFrame} written after the log
+        import pandas as pd
+        df = self.read()
+        with pd.ExcelWriter(xlsx_path, engine='openpyxl') as writer:
+            df.to_excel(writer, index=False, sheet_name=sheet_name)
+            for name, extra in (extra_sheets or {}).items():
+                extra.to_excel(writer, index=False, sheet_name=name)
+        return df
+
+
+def csv_to_excel(csv_path, xlsx_path=None, sheet_name='Sheet1'):
+    import pandas as pd
+    if xlsx_path is None:
+        xlsx_path = os.path.splitext(csv_path)[0] + '.xlsx'
+    df = pd.read_csv(csv_path, encoding='utf-8')
+    df.to_excel(xlsx_path, index=False, sheet_name=sheet_name)
+    return xlsx_path
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        sys.exit("usage: python3 uwb_log.py log.csv [out.xlsx]")
+    print(csv_to_excel(*sys.argv[1:3]))
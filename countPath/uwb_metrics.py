@@ -0,0 +1,117 @@
+"""
+Per-stage latency histograms and pipeline counters, rendered in the
+Prometheus text format (server.py serves them at /metrics).
+
+    with metrics.timer('parse'):
+        frames = parser.feed(data)
+    metrics.count_frames(frames)
+
+Stages used by the pipeline: serial_wait, parse, solve, filter, route, http.
+"""
+import bisect
+import time
+from contextlib import contextmanager
+from threading import Lock
+
+import numpy as np
+
+BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+           0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)     # seconds
+RECENT = 1024           # samples kept per stage for the rolling quantiles
+QUANTILES = (0.5, 0.9, 0.99)
+# counters always rendered (0 until counted); any other counter is rendered too, with a generic help
+COUNTERS = {
+    'frames': 'Range frames parsed.',
+    'invalid_ranges': 'Frames with an invalid or overflowed range (>= 32768 cm).',
+    'incomplete_fixes': 'Reads or range sets dropped because an anchor was missing.',
+    'degraded_fixes': 'Range sets solved from the anchors that reported before the deadline.',
+    'deadline_misses': 'Reads that hit their deadline before every anchor reported.',
+    'stale_fixes': 'Times a tag went stale: no new position within the deadline.',
+    'flushed_bytes': 'Serial input bytes dropped when a new measurement started.',
+}
+
+
+class Histogram:
+    # cumulative bucket counts since start, plus a ring of the most recent samples
+    def __init__(self, buckets=BUCKETS, recent=RECENT):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)      # last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+        self.recent = np.zeros(recent)
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.recent[self.count % len(self.recent)] = value
+        self.sum += value
+        self.count += 1
+
+    def quantiles(self, qs=QUANTILES):
+        n = min(self.count, len(self.recent))
+        if n == 0:
+            return [float('nan')] * len(qs)
+        return np.quantile(self.recent[:n], qs).tolist()
+
+
+class Metrics:
+    def __init__(self):
+        self.lock = Lock()
+        self.stages = {}        # (stage, labels) -> Histogram
+        self.counters = {}      # name -> count
+
+    def observe(self, stage, seconds, **labels):
+        key = (stage, tuple(sorted(labels.items())))
+        with self.lock:
+            hist = self.stages.get(key)
+            if hist is None:
+                hist = self.stages[key] = Histogram()
+            hist.observe(seconds)
+
+    @contextmanager
+    def timer(self, stage, **labels):
+        t = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - t, **labels)
+
+    def inc(self, name, n=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def count_frames(self, frames):
+        self.inc('frames', len(frames))
+        invalid = sum(1 for frame in frames if not frame.valid)
+        if invalid:
+            self.inc('invalid_ranges', invalid)
+
+    def render(self, extra=()):
+        # extra: (name, type, value, help) lines appended after the pipeline metrics
+        out = ['# HELP uwb_stage_seconds Time spent in each pipeline stage.',
+               '# TYPE uwb_stage_seconds histogram']
+        recent = ['# HELP uwb_stage_recent_seconds Quantiles of the last {} samples per stage.'.format(RECENT),
+                  '# TYPE uwb_stage_recent_seconds gauge']
+        with self.lock:
+            for (stage, labels), hist in sorted(self.stages.items()):
+                base = 'stage="{}"'.format(stage) + ''.join(',{}="{}"'.format(k, v) for k, v in labels)
+                total = 0
+                for le, n in zip(list(hist.buckets) + ['+Inf'], hist.counts):
+                    total += n
+                    out.append('uwb_stage_seconds_bucket{{{},le="{}"}} {}'.format(base, le, total))
+                out.append('uwb_stage_seconds_sum{{{}}} {}'.format(base, hist.sum))
+                out.append('uwb_stage_seconds_count{{{}}} {}'.format(base, hist.count))
+                for q, v in zip(QUANTILES, hist.quantiles()):
+                    recent.append('uwb_stage_recent_seconds{{{},quantile="{}"}} {}'.format(base, q, v))
+            counters = dict(self.counters)
+        out += recent
+        for name in list(COUNTERS) + sorted(set(counters) - set(COUNTERS)):
+            help_text = COUNTERS.get(name, name.replace('_', ' ').capitalize() + '.')
+            out += ['# HELP uwb_{}_total {}'.format(name, help_text), '# TYPE uwb_{}_total counter'.format(name),
+                    'uwb_{}_total {}'.format(name, counters.get(name, 0))]
+        for name, kind, value, help_text in extra:
+            out += ['# HELP {} {}'.format(name, help_text), '# TYPE {} {}'.format(name, kind),
+                    '{} {}'.format(name, value)]
+        return '\n'.join(out) + '\n'
+
+
+metrics = Metrics()
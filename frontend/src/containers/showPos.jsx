@@ -13,7 +13,7 @@ export default function ShowPos(props) {
   const mapRef = useRef();
   const mapContainerRef = useRef();
   const navigate = useNavigate();
-  const { userPos } = useIoT();
+  const { userPos, watchUserPos } = useIoT();
 
   // setup map
   useEffect(() => {
@@ -112,6 +112,19 @@ export default function ShowPos(props) {
     };
   }, []);
 
+  // follow the live position while this page is open
+  useEffect(() => watchUserPos(), []);
+  useEffect(() => {
+    const source = mapRef.current && mapRef.current.getSource("currentPos");
+    if (source) {
+      source.setData({
+        type: "Feature",
+        properties: {},
+        geometry: { type: "Point", coordinates: userPos },
+      });
+    }
+  }, [userPos]);
+
   return (
     <div id="map">
       <>
@@ -27,6 +27,7 @@ const IoTContext = createContext({
   islogin: Boolean,
   userPos: [],
   getUserPos: () => {},
+  watchUserPos: () => {},
   task: "",
   singlePalletInfo: {},
   getPalletInfo: () => {}, //Todo
@@ -105,12 +106,25 @@ const IoTProvider = (props) => {
     fetch("http://192.168.0.236:5500/pos")
       .then((response) => response.json())
       .then((data) => {
-        setUserPos([data[1], data[0]]);
+        const [lat, lng] = data.pos;
+        setUserPos([lng, lat]);
       })
       .catch((error) => {
         console.error("Error fetching position:", error);
       });
   };
+  const watchUserPos = () => {
+    // follow the position stream; returns a function that closes it
+    const source = new EventSource("http://192.168.0.236:5500/pos/stream");
+    source.onmessage = (event) => {
+      const [lat, lng] = JSON.parse(event.data).pos;
+      setUserPos([lng, lat]);
+    };
+    source.onerror = (error) => {
+      console.error("Error in position stream:", error);
+    };
+    return () => source.close();
+  };
   // For putDown
   // get pallet info by using user's pallet id
   const getPalletInfo = async () => {
@@ -289,6 +303,7 @@ const IoTProvider = (props) => {
         setTask,
         userPos,
         getUserPos,
+        watchUserPos,
         islogin,
         setIslogin,
         pending,